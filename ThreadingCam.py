@@ -9,29 +9,52 @@ copyright: © 2024 N.K.F.Lee
 """
 
 import cv2 as cv
+import math
 import threading
 import time
 import numpy as np
 from datetime import datetime
 
-
-class Frame:
-    def __init__(self, image, timestamp):
-        self.image = image
-        self.timestamp = timestamp
+from motion import ChangeDetector
 
 
 class ThreadCap:
-    def __init__(self, camera_index=0, width=640, height=400, fps=240):
+    """后台线程采集摄像头，帧写入预分配的环形缓冲区
+
+    采集线程写槽位之前先把它的序号作废，写完后才发布新序号，读取最新帧不需要加锁。
+    read_latest / read_next 返回只读视图，不拷贝；视图所在槽位在采集 slots - 1 帧后
+    会被覆盖，需要更久持有时用 valid() 检查或自行拷贝。
+
+    Args:
+        camera_index (int, optional): 摄像头编号. Defaults to 0.
+        width (int, optional): 宽. Defaults to 640.
+        height (int, optional): 高. Defaults to 400.
+        fps (int, optional): 帧率. Defaults to 240.
+        slots (int, optional): 环形缓冲区槽位数. Defaults to 4.
+        detector (ChangeDetector, optional): 判断新帧是否与上一发布帧相似，相似的不发布.
+            Defaults to None，使用缩略图灰度差，阈值 8.
+    """
+
+    def __init__(
+        self, camera_index=0, width=640, height=400, fps=240, slots=4, detector=None
+    ):
         self.cap = cv.VideoCapture(camera_index)
         self.cap.set(cv.CAP_PROP_FRAME_WIDTH, width)
         self.cap.set(cv.CAP_PROP_FRAME_HEIGHT, height)
         self.cap.set(cv.CAP_PROP_FOURCC, cv.VideoWriter.fourcc(*"MJPG"))
         self.cap.set(cv.CAP_PROP_FPS, fps)
 
-        self.frame = None
-        self.last_frame = None
-        self.lock = threading.Lock()
+        self.slots = slots
+        self._images = [np.empty((height, width, 3), np.uint8) for _ in range(slots)]
+        self._seqs = [-1] * slots
+        self._stamps = [0.0] * slots
+        self._scores = [math.inf] * slots
+        # 可以在运行中修改 detector.roi，只看棋盘区域
+        self.detector = detector if detector is not None else ChangeDetector()
+        self.seq = -1  # 最新发布的帧序号
+        self.similar = 0  # 与上一帧相似而未发布的帧数
+        self.dropped = 0  # read_next 的使用者没来得及读就被覆盖的帧数
+        self._cond = threading.Condition()
         self.stop_flag = False
 
         self.thread = threading.Thread(target=self._update_frame, daemon=True)
@@ -39,52 +62,126 @@ class ThreadCap:
 
     def _update_frame(self):
         while not self.stop_flag:
-            ret, frame_gray = self.cap.read()
-            if ret:
-                # frame_gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
-
-                if not self.last_frame or not self._are_frames_similar(
-                    frame_gray, self.last_frame.image
+            slot = (self.seq + 1) % self.slots
+            # 先作废槽位里的旧帧再写，写到一半时 valid() 已经返回 False
+            self._seqs[slot] = -1
+            ret, image = self.cap.read(self._images[slot])
+            if not ret:
+                continue
+            if (
+                image is not self._images[slot]
+            ):  # 实际分辨率与预设不同，按实际的重新分配
+                self._images = [np.empty_like(image) for _ in range(self.slots)]
+                self._images[slot] = image
+            score = self.detector.measure(image)
+            if score < self.detector.threshold:
+                self.similar += 1
+                continue
+            self.detector.accept()
+            seq = self.seq + 1
+            self._stamps[slot] = time.time()
+            self._scores[slot] = score
+            self._seqs[slot] = seq
+            self.seq = seq  # 最后一步才发布
+            with self._cond:
+                self._cond.notify_all()
+
+    def score(self, seq):
+        """序号为 seq 的帧与上一发布帧的差异分数，第一帧为 inf"""
+        return self._scores[seq % self.slots]
+
+    def _view(self, seq):
+        view = self._images[seq % self.slots].view()
+        view.flags.writeable = False
+        return view
+
+    def valid(self, seq):
+        """序号为 seq 的帧是否还在缓冲区里，没有被覆盖"""
+        return self._seqs[seq % self.slots] == seq
+
+    def read_latest(self):
+        """最新一帧，不拷贝
+
+        Returns:
+            tuple: (序号, 时间戳, 只读视图)，还没有帧时为 (-1, None, None)
+        """
+        seq = self.seq
+        if seq < 0:
+            return -1, None, None
+        return seq, self._stamps[seq % self.slots], self._view(seq)
+
+    def read_next(self, last_seq, timeout=None):
+        """last_seq 之后第一帧还没被覆盖的帧，没有新帧时阻塞等待
+
+        Args:
+            last_seq (int): 上次读到的序号，第一次读用 -1
+            timeout (float, optional): 最长等待秒数. Defaults to None，一直等.
+
+        Returns:
+            tuple: (序号, 时间戳, 只读视图)，超时为 (-1, None, None)
+        """
+        if self.seq <= last_seq:
+            with self._cond:
+                if not self._cond.wait_for(
+                    lambda: self.seq > last_seq or self.stop_flag, timeout
                 ):
-                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
-                    frame_with_timestamp = self._add_timestamp(frame_gray, timestamp)
-
-                    with self.lock:
-                        self.frame = Frame(frame_with_timestamp, timestamp)
-                        self.last_frame = Frame(frame_gray, timestamp)
-
-    def _compute_mse(self, imageA, imageB):
-        """计算两张图片的均方误差"""
-        err = np.sum((imageA.astype("float") - imageB.astype("float")) ** 2)
-        err /= float(imageA.shape[0] * imageA.shape[1])
-        return err
-
-    def _are_frames_similar(self, frame1, frame2, threshold=10):
-        """判断两张图片是否相似"""
-        mse = self._compute_mse(frame1, frame2)
-        return mse < threshold
-
-    def _add_timestamp(self, frame, timestamp):
-        """在图像上添加时间戳"""
-        font = cv.FONT_HERSHEY_SIMPLEX
-        # cv.putText(frame, timestamp, (10, 30), font, 1, (255), 2, cv.LINE_AA)
-        return frame
+                    return -1, None, None
+            if self.seq <= last_seq:
+                return -1, None, None
+        # 落后太多时，最旧的槽位可能正在被写，跳到还安全的那一帧
+        seq = max(last_seq + 1, self.seq - self.slots + 2)
+        self.dropped += seq - last_seq - 1 if last_seq >= 0 else 0
+        return seq, self._stamps[seq % self.slots], self._view(seq)
 
     def read(self):
-        with self.lock:
-            frame_copy = self.frame.image.copy() if self.frame is not None else None
-            timestamp = self.frame.timestamp if self.frame is not None else None
-        return (timestamp, frame_copy)
+        """兼容旧接口，返回 (时间字符串, 可写的拷贝)"""
+        while True:
+            seq, stamp, view = self.read_latest()
+            if seq < 0:
+                return None, None
+            frame_copy = view.copy()
+            if self.valid(seq):  # 拷贝期间没有被覆盖
+                break
+        timestamp = datetime.fromtimestamp(stamp).strftime("%Y-%m-%d %H:%M:%S.%f")
+        return timestamp, frame_copy
 
     def isOpened(self):
         return self.cap.isOpened()
 
     def release(self):
         self.stop_flag = True
+        with self._cond:
+            self._cond.notify_all()
         self.thread.join()
         self.cap.release()
 
 
+def next_frame(cap, last_seq, timeout=0.1):
+    """主循环取帧：有 read_next 的来源（ThreadCap）取只读视图，其他来源用 read
+
+    ThreadCap 不发布与上一帧相似的画面，棋盘静止时 read_next 会一直超时。
+    超时后返回最新一帧（与上次相同），主循环照常处理串口指令，不当作取帧失败。
+
+    Args:
+        cap: 帧来源
+        last_seq (int): 上次读到的序号，第一次读用 -1
+        timeout (float, optional): 等新帧的最长时间，秒，也是画面静止时主循环的周期. Defaults to 0.1.
+
+    Returns:
+        tuple: (是否取到, 图片, 新的 last_seq)，来源已结束或还没有任何帧时为 (False, None, last_seq)
+    """
+    if not hasattr(cap, "read_next"):
+        ret, frame = cap.read()
+        return ret, frame, last_seq
+    seq, _, frame = cap.read_next(last_seq, timeout)
+    if seq >= 0:
+        return True, frame, seq
+    if cap.stop_flag:
+        return False, None, last_seq
+    seq, _, frame = cap.read_latest()
+    return seq >= 0, frame, last_seq
+
+
 # 使用 ThreadCap 类
 def main():
     cam = ThreadCap(camera_index=0, width=640, height=400)
@@ -0,0 +1,280 @@
+"""
+filename: bench_detection.py
+author: Neolux Lee
+created: 2026-10-18
+last modified: 2026-10-18
+descrip: 识别测速，在合成画面上统计各个识别函数的帧率、内存分配和准确率，并与基线比较
+version: 1.0
+copyright: © 2024 N.K.F.Lee
+"""
+
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+import config as C
+import detection
+import neu
+from synthetic import generate
+
+BASELINE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json"
+)
+
+# 格子编号跳变的旋转角度，见 detection.BoardModel；在此之外 find_field 的顺序与棋盘上的实际编号不同，
+# 跳变点附近的顺序由 selfcheck 的 field_order_at_45 检查
+JUMP_ANGLE = 45 - np.degrees(detection.TIE_ANGLE) / 2
+
+# 名字 -> {"style": 画面风格, "run": run(sample, frame), "score": score(sample, result)}
+BENCHES = {}
+
+
+def bench(name, score, style="main"):
+    """注册一项测试，run 计时，score 与真值比较返回 {指标: 0~1 或误差}"""
+
+    def decorator(run):
+        BENCHES[name] = {"style": style, "run": run, "score": score}
+        return run
+
+    return decorator
+
+
+def _match_error(found, truth):
+    """每个检测点到最近真值点的最大距离，与顺序无关"""
+    found = np.asarray(found, np.float32).reshape(-1, 2)
+    dist = np.linalg.norm(found[:, None] - truth[None], axis=2)
+    return float(dist.min(axis=1).max())
+
+
+def _score_field(sample, centers):
+    if centers is None or not len(centers) == 9:
+        return {"found": 0.0}
+    centers = np.asarray(centers, np.float32).reshape(9, 2)
+    result = {"found": 1.0, "err_px": _match_error(centers, sample.centers)}
+    # 真值是棋盘上的实际编号，跳变点附近 find_field 取哪个角由检测误差决定，不检查顺序
+    if abs(sample.params["angle"]) < JUMP_ANGLE - 0.5:
+        cell = 60 * sample.params["scale"]
+        ordered = np.linalg.norm(centers - sample.centers, axis=1).max() < cell / 2
+        result["order"] = float(ordered)
+    return result
+
+
+def _board_bounds(sample):
+    """棋盘左右极限，与 find_field 的 pole 含义相同"""
+    half = 30 * sample.params["scale"]
+    xs = sample.centers[:, 0]
+    return int(xs.min() - half), int(xs.max() + half)
+
+
+def _score_pieces(sample, pieces):
+    ok = True
+    for name in ("white", "black"):
+        truth = np.asarray(getattr(sample, name), np.float32).reshape(-1, 2)
+        found = pieces[name]
+        if len(found) != len(truth):
+            ok = False
+        elif len(found) and _match_error(found, truth) > 6:
+            ok = False
+    return {"exact": float(ok)}
+
+
+def _score_board(sample, board):
+    # 任务 4 时浅色为 X
+    expected = {"W": "X", "B": "O", " ": " "}
+    hits = sum(
+        board[r][c] == expected[sample.board[r][c]] for r in range(3) for c in range(3)
+    )
+    return {"cells": hits / 9, "exact": float(hits == 9)}
+
+
+def _score_neu_field(sample, centers):
+    if centers is None:
+        return {"found": 0.0}
+    return {"found": 1.0, "err_px": _match_error(centers, sample.centers)}
+
+
+@bench("find_field", _score_field)
+def _find_field(sample, frame):
+    return detection.find_field(frame, factor=1)[0]
+
+
+_ctx = detection.FrameContext()
+
+
+@bench("find_field+ctx", _score_field)
+def _find_field_ctx(sample, frame):
+    return detection.find_field(frame, ctx=_ctx.update(frame), factor=1)[0]
+
+
+@bench("find_field/2", _score_field)
+def _find_field_2(sample, frame):
+    return detection.find_field(frame, factor=2)[0]
+
+
+@bench("find_field/2+ctx", _score_field)
+def _find_field_2_ctx(sample, frame):
+    return detection.find_field(frame, ctx=_ctx.update(frame), factor=2)[0]
+
+
+@bench("find_field/3", _score_field)
+def _find_field_3(sample, frame):
+    return detection.find_field(frame, factor=3)[0]
+
+
+@bench("find_field/4", _score_field)
+def _find_field_4(sample, frame):
+    return detection.find_field(frame, factor=4)[0]
+
+
+@bench("find_pieces", _score_pieces)
+def _find_pieces(sample, frame):
+    return detection.find_pieces(frame, *_board_bounds(sample))
+
+
+@bench("find_pieces+ctx", _score_pieces)
+def _find_pieces_ctx(sample, frame):
+    return detection.find_pieces(frame, *_board_bounds(sample), _ctx.update(frame))
+
+
+@bench("find_pieces_cc", _score_pieces)
+def _find_pieces_cc(sample, frame):
+    return detection.find_pieces_cc(frame, *_board_bounds(sample))
+
+
+@bench("find_pieces_cc+ctx", _score_pieces)
+def _find_pieces_cc_ctx(sample, frame):
+    return detection.find_pieces_cc(frame, *_board_bounds(sample), _ctx.update(frame))
+
+
+@bench("read_board", _score_board)
+def _read_board(sample, frame):
+    detection.blocks_center = np.round(sample.centers).astype(np.int32)
+    return detection.read_board(frame, 4)
+
+
+@bench("neu.find_field", _score_neu_field, style="neu")
+def _neu_find_field(sample, frame):
+    return neu.find_field(frame)
+
+
+def run_bench(name, samples, alloc_frames=100):
+    """对每一帧计时并打分
+
+    Returns:
+        dict: frames, fps, mean_ms, p95_ms, alloc_kb（每帧峰值新增内存），以及各项准确率的均值
+    """
+    entry = BENCHES[name]
+    run, score = entry["run"], entry["score"]
+    frame = np.empty_like(samples[0].frame)
+    times = np.empty(len(samples), np.int64)
+    scores = []
+    for i, sample in enumerate(samples):
+        np.copyto(frame, sample.frame)  # 每次用同一块内存，与取帧时相同
+        t0 = time.perf_counter_ns()
+        result = run(sample, frame)
+        times[i] = time.perf_counter_ns() - t0
+        scores.append(score(sample, result))
+    # tracemalloc 会拖慢运行，单独跑一小部分帧统计内存
+    peaks = []
+    tracemalloc.start()
+    for sample in samples[:alloc_frames]:
+        np.copyto(frame, sample.frame)
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        run(sample, frame)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    total = times.sum() / 1e9
+    result = {
+        "frames": len(samples),
+        "fps": len(samples) / total if total > 0 else 0.0,
+        "mean_ms": float(times.mean() / 1e6),
+        "p95_ms": float(np.percentile(times, 95) / 1e6),
+        "alloc_kb": float(np.mean(peaks) / 1024) if peaks else 0.0,
+    }
+    keys = sorted({key for s in scores for key in s})
+    for key in keys:
+        values = [s[key] for s in scores if key in s]
+        result[key] = float(np.mean(values)) if values else 0.0
+    return result
+
+
+def compare(results, baseline, speed_tol=0.25, acc_tol=0.01, err_tol=0.5):
+    """与基线比较，返回退步的说明列表
+
+    帧率与机器有关，只在低于基线 speed_tol 比例时报告；帧数与基线相同时，
+    准确率下降超过 acc_tol、位置误差增加超过 err_tol 像素时报告。
+    """
+    problems = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["fps"] < base["fps"] * (1 - speed_tol):
+            problems.append(
+                f"{name}: fps {result['fps']:.1f} < baseline {base['fps']:.1f}"
+            )
+        # 准确率只在同一组画面上可比
+        if result["frames"] != base.get("frames"):
+            continue
+        for key in ("found", "order", "cells", "exact"):
+            if key in base and result.get(key, 0.0) < base[key] - acc_tol:
+                problems.append(
+                    f"{name}: {key} {result.get(key, 0.0):.3f} < baseline {base[key]:.3f}"
+                )
+        if "err_px" in base and result.get("err_px", np.inf) > base["err_px"] + err_tol:
+            problems.append(
+                f"{name}: err_px {result.get('err_px', np.inf):.2f} > baseline {base['err_px']:.2f}"
+            )
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="识别测速（合成画面）")
+    parser.add_argument("-n", "--frames", type=int, default=1000, help="每项测试的帧数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--only", action="append", help="只跑指定的测试，可重复")
+    parser.add_argument("--baseline", default=BASELINE, help="基线文件")
+    parser.add_argument("--save", action="store_true", help="把本次结果写为基线")
+    args = parser.parse_args(argv)
+
+    C.headless = True
+    names = args.only or list(BENCHES)
+    samples = {}
+    results = {}
+    for name in names:
+        style = BENCHES[name]["style"]
+        if style not in samples:
+            samples[style] = generate(args.frames, args.seed, style)
+        results[name] = run_bench(name, samples[style])
+        summary = ", ".join(
+            f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+            for key, value in results[name].items()
+        )
+        print(f"{name}: {summary}")
+
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as f:
+        problems = compare(results, json.load(f))
+    for problem in problems:
+        print("Regression:", problem)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    exit(main())
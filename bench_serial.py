@@ -0,0 +1,145 @@
+"""
+filename: bench_serial.py
+author: Neolux Lee
+created: 2026-10-18
+last modified: 2026-10-18
+descrip: 串口测速，用假下位机测指令到落子的延迟和 transmission 的持续吞吐
+version: 1.0
+copyright: © 2024 N.K.F.Lee
+"""
+
+import argparse
+import contextlib
+import io
+import threading
+import time
+
+import numpy as np
+
+import synthetic
+import transmission
+from fake_mcu import FakeMCU
+from protocol import MOVE_FRAME, TASK_4, encode_command
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1e3 if values else 0.0
+
+
+class StillCamera:
+    """按帧率不停地给出同一帧的假摄像头，接口与 cv.VideoCapture 相同
+
+    Args:
+        frame: 画面
+        fps (int, optional): 帧率. Defaults to 120.
+    """
+
+    def __init__(self, frame, fps=120):
+        self.frame = frame
+        self.period = 1 / fps
+        self.exhausted = False  # 置为 True 后 main 按回放结束正常退出
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        time.sleep(self.period)
+        if self.exhausted:
+            return False, None
+        return True, self.frame
+
+    def release(self):
+        self.exhausted = True
+
+
+def bench_latency(baud, rounds=50, fps=120):
+    """假下位机发出任务指令，到它收到 main 给出的落子为止
+
+    跑的是完整的 main：后台线程读指令、取帧、识别、读棋盘、查表、串口发送，
+    串口是 serial_port="fake" 时的假下位机，画面是中间有一枚白棋的合成棋盘。
+    """
+    import config as C
+    import main
+
+    C.headless = True
+    board = [[" "] * 3 for _ in range(3)]
+    board[1][1] = "W"
+    camera = StillCamera(synthetic.render(board=board).frame, fps)
+    mcu = FakeMCU(baud)
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):  # main 每帧的输出不混进结果
+        thread = threading.Thread(
+            target=main.main, kwargs={"cap": camera, "serial": mcu.host}, daemon=True
+        )
+        thread.start()
+        time.sleep(0.5)  # 等走法表建好、识别出格子
+        for i in range(rounds):
+            mcu.command(TASK_4)
+            if not mcu.wait_move(i + 1, timeout=2):
+                break
+        camera.release()
+        thread.join(5)
+    mcu.close()
+    return {
+        "rounds": len(mcu.latencies),
+        "p50_ms": percentile(mcu.latencies, 50),
+        "p95_ms": percentile(mcu.latencies, 95),
+        "max_ms": max(mcu.latencies) * 1e3 if mcu.latencies else 0.0,
+        # 指令和落子数据包在线上的时间
+        "wire_ms": (len(encode_command(TASK_4)) + MOVE_FRAME.size) * 10 / baud * 1e3,
+        "frame_ms": 1e3 / fps,
+    }
+
+
+def bench_throughput(baud, seconds=2.0, fps=120, delta=False):
+    """按帧率不停地发格子和棋子坐标，统计下位机每秒收到的数据包
+
+    速率按发送开始到最后一个字节到达下位机计，不会超过线路速率。
+    """
+    mcu = FakeMCU(baud)
+    sender = transmission.DeltaSender(budget=baud / 10 * 0.8) if delta else None
+    transport = transmission.bind(mcu.host, delta_sender=sender)
+    rng = np.random.default_rng(0)
+    base = np.array([(200 + 60 * (i % 3), 120 + 60 * (i // 3)) for i in range(9)])
+    frames = 0
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < seconds:
+        jitter = rng.integers(-1, 2, base.shape)
+        if frames % fps == 0:
+            base[rng.integers(9)] += 10  # 偶尔真的动一下
+        vertices = base + jitter
+        pieces = {"black": [(50, 60 + 40 * i) for i in range(5)], "white": []}
+        transmission.send_frame(vertices, pieces)
+        frames += 1
+        time.sleep(1 / fps)
+    # 假下位机的发送缓冲区能吸收几秒的积压，等数据全部到达对端再算速率
+    transport.flush()
+    mcu.to_mcu.drain()
+    elapsed = time.monotonic() - t0
+    received = sum(mcu.counts.values())
+    result = {
+        "frames": frames,
+        "packets_per_s": received / elapsed,
+        "written_bytes_per_s": transport.stats["bytes"] / elapsed,
+        "dropped": transport.stats["dropped"],
+        "line_bytes_per_s": baud / 10,
+    }
+    if sender is not None:
+        result["saved_bytes"] = sender.stats["saved"]
+    transport.close()
+    mcu.close()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="串口测速（假下位机）")
+    parser.add_argument("-b", "--baud", type=int, action="append", help="波特率")
+    parser.add_argument("-n", "--rounds", type=int, default=50, help="延迟测试次数")
+    parser.add_argument("-t", "--seconds", type=float, default=2.0, help="吞吐测试时长")
+    args = parser.parse_args()
+
+    for baud in args.baud or [9600, 115200]:
+        print(f"Baud {baud}")
+        print("  Command -> move:", bench_latency(baud, args.rounds))
+        print("  Full frames:", bench_throughput(baud, args.seconds))
+        print("  Delta frames:", bench_throughput(baud, args.seconds, delta=True))
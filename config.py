@@ -1,12 +1,42 @@
 debug = True
+# 不开窗口显示，回放或没有显示器时使用
+headless = False
+# 调试画面："window" 开窗口，"mjpeg" 浏览器打开 http://preview_host:preview_port/，"off" 不显示
+# 绘制和显示在单独的线程上，按 preview_fps 限速、按 preview_scale 缩小，不占识别的时间
+preview = "window"
+preview_fps = 15
+preview_scale = 0.5
+preview_host = "127.0.0.1"
+preview_port = 8080
 
 # 通讯参数
+# 设备路径、pyserial 的 URL（如 "loop://"），或 "fake" 使用内存里的假下位机
 serial_port = "/dev/ttyUSB0"
 serial_baud = 9600
+# 坐标只在变化超过容差时发送，定期全量刷新，每秒字节数不超过预算
+delta_tx = True
+delta_tolerance = 2
+delta_refresh = 1.0
+tx_budget = serial_baud / 10 * 0.8  # 8N1 每字节 10 位，留两成余量给指令
 
 # 是否使用多线程读取摄像机
 threading_cam = False
 cam_id = 2
+# 棋子识别："contour" 轮廓逐个判断；"cc" 连通域统计批量筛选，只对候选取轮廓
+piece_detector = "contour"
+# 棋盘识别先在缩小 field_pyramid 倍的图上找，找不齐时退回原分辨率；1 时只按原分辨率查找
+field_pyramid = 1
+# 棋盘不动时只在上一次位置附近查找
+track_field = True
+# 画面静止时复用上一次的识别结果，不重复识别和发送
+gate_frames = True
+# 流水线模式：取帧、识别、对局逻辑、显示分别在不同线程上
+pipeline = False
+detect_workers = 1
+# 分阶段计时，关闭时几乎没有开销；trace / json 为退出时导出的文件路径，空字符串不导出
+profile = False
+profile_trace = ""
+profile_json = ""
 # 主程序返回值
 class ErrCode:
     CAM_NO_OPENED = 229
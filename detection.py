@@ -1,3 +1,5 @@
+import functools
+
 import cv2 as cv
 import numpy as np
 import time, datetime
@@ -6,19 +8,21 @@ import config as C
 from config import ErrCode
 
 
-def is_square(contour):
+def is_square(contour, eps=0.04, tol=0.1):
     """判断是否为方格
 
     Args:
         contour (_type_): 一个轮廓
+        eps (float, optional): 多边形逼近的精度，周长的比例. Defaults to 0.04.
+        tol (float, optional): 面积与最小外接矩形面积之比偏离 1 的容差. Defaults to 0.1.
 
     Returns:
         _type_: 方格中心坐标，若不是方格则返回 (-1, -1)
     """
     perimeter = cv.arcLength(contour, True)
-    approx = cv.approxPolyDP(contour, 0.04 * perimeter, True)
+    approx = cv.approxPolyDP(contour, eps * perimeter, True)
     (x, y), (w, h), angle = cv.minAreaRect(contour)
-    if len(approx) == 4 and 0.9 < cv.contourArea(contour) / (w * h) < 1.1:
+    if len(approx) == 4 and 1 - tol < cv.contourArea(contour) / (w * h) < 1 + tol:
         M = cv.moments(contour)
         if M["m00"] != 0:
             cx = int(M["m10"] / M["m00"])
@@ -27,87 +31,369 @@ def is_square(contour):
     return -1, -1
 
 
-def vector_angle(vec1, vec2):
-    """Calculate the angle between two vectors. (0 < angle < 180)
+def contour_features(contours):
+    """一次性算出全部轮廓的廉价特征
+
+    所有点拼成一个数组，用 reduceat 按轮廓分段求和 / 求极值，不逐个调用 OpenCV。
+    面积用鞋带公式，与 cv.contourArea 的结果完全一致。
+
+    Args:
+        contours (list): findContours 得到的轮廓
+
+    Returns:
+        tuple: 面积、外接矩形宽、外接矩形高，均为长度与轮廓数相同的数组
+    """
+    if len(contours) == 0:
+        empty = np.zeros(0)
+        return empty, empty, empty
+    counts = np.fromiter((len(c) for c in contours), np.intp, len(contours))
+    starts = np.zeros_like(counts)
+    np.cumsum(counts[:-1], out=starts[1:])
+    pts = np.concatenate(contours).reshape(-1, 2).astype(np.float64)
+    nxt = np.arange(1, len(pts) + 1)
+    nxt[starts + counts - 1] = starts  # 每段最后一个点接回第一个点
+    cross = pts[:, 0] * pts[nxt, 1] - pts[nxt, 0] * pts[:, 1]
+    area = np.abs(np.add.reduceat(cross, starts)) / 2
+    w = np.maximum.reduceat(pts[:, 0], starts) - np.minimum.reduceat(pts[:, 0], starts)
+    h = np.maximum.reduceat(pts[:, 1], starts) - np.minimum.reduceat(pts[:, 1], starts)
+    return area, w + 1, h + 1
+
+
+class CandidateFilter:
+    """两级轮廓筛选：先用廉价特征批量剔除，剩下的再做形状判断
+
+    阈值取得较松，能通过形状判断、长宽比在 max_aspect 以内的轮廓不会在第一级被剔除，
+    min_extent 见 rect_min_extent。
 
     Args:
-        vec1 (_type_): _description_
-        vec2 (_type_): _description_
+        min_area (float): 最小面积
+        min_extent (float): 面积与外接矩形面积之比的下限
+        max_aspect (float): 外接矩形长宽比的上限（取大于 1 的那个方向）
     """
-    angle = np.arccos(
-        np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
-    )
-    # if np.cross(vec1, vec2) < 0:
-    #     angle = -angle
-    return np.degrees(angle)
+
+    def __init__(self, min_area, min_extent, max_aspect):
+        self.min_area = min_area
+        self.min_extent = min_extent
+        self.max_aspect = max_aspect
+        self.stats = {
+            "candidates": 0,
+            "area": 0,
+            "extent": 0,
+            "aspect": 0,
+            "shape": 0,
+            "passed": 0,
+        }
+
+    def select(self, contours, shape_test, scale=1.0):
+        """筛选轮廓
+
+        Args:
+            contours (list): 轮廓
+            shape_test (function): 形状判断，如 is_square，返回 (-1, -1) 表示不通过
+            scale (float, optional): 图片相对原图的缩放，面积阈值按平方缩放. Defaults to 1.0.
+
+        Returns:
+            list: [(轮廓, (cx, cy))]，保持原顺序
+        """
+        area, w, h = contour_features(contours)
+        stats = self.stats
+        stats["candidates"] += len(contours)
+        keep = area >= self.min_area * scale * scale
+        stats["area"] += len(contours) - int(np.count_nonzero(keep))
+        extent_ok = area >= self.min_extent * w * h
+        stats["extent"] += int(np.count_nonzero(keep & ~extent_ok))
+        keep &= extent_ok
+        aspect_ok = (w <= self.max_aspect * h) & (h <= self.max_aspect * w)
+        stats["aspect"] += int(np.count_nonzero(keep & ~aspect_ok))
+        keep &= aspect_ok
+        selected = []
+        for idx in np.flatnonzero(keep):
+            cx, cy = shape_test(contours[idx])
+            if cx == -1:
+                stats["shape"] += 1
+                continue
+            selected.append((contours[idx], (cx, cy)))
+        stats["passed"] += len(selected)
+        return selected
+
+    def select_blobs(self, labels, stats, centroids, shape_test, scale=1.0):
+        """筛选 connectedComponentsWithStats 得到的连通域
+
+        面积为像素数，不含内部的孔，其余与 select 相同；形状判断只对通过前三项的
+        连通域进行，在它的外接矩形内取外轮廓。
+
+        Args:
+            labels (np.ndarray): 标签图
+            stats (np.ndarray): 每个连通域的 (x, y, w, h, 面积)，0 号为背景
+            centroids (np.ndarray): 每个连通域的质心
+            shape_test (function): 形状判断，如 is_circle
+            scale (float, optional): 标签图相对原图的缩放，面积阈值按平方缩放. Defaults to 1.0.
+
+        Returns:
+            list: [(cx, cy)] 浮点质心，标签图坐标，按标签顺序
+        """
+        x, y, w, h, area = stats[1:].T
+        counts = self.stats
+        counts["candidates"] += len(area)
+        keep = area >= self.min_area * scale * scale
+        counts["area"] += len(area) - int(np.count_nonzero(keep))
+        extent_ok = area >= self.min_extent * w * h
+        counts["extent"] += int(np.count_nonzero(keep & ~extent_ok))
+        keep &= extent_ok
+        aspect_ok = (w <= self.max_aspect * h) & (h <= self.max_aspect * w)
+        counts["aspect"] += int(np.count_nonzero(keep & ~aspect_ok))
+        keep &= aspect_ok
+        selected = []
+        for idx in np.flatnonzero(keep):
+            label = idx + 1
+            x0, y0 = x[idx], y[idx]
+            patch = labels[y0 : y0 + h[idx], x0 : x0 + w[idx]] == label
+            cnts, _ = cv.findContours(
+                patch.view(np.uint8), cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE
+            )
+            if not cnts or shape_test(max(cnts, key=len))[0] == -1:
+                counts["shape"] += 1
+                continue
+            cx, cy = centroids[label]
+            selected.append((float(cx), float(cy)))
+        counts["passed"] += len(selected)
+        return selected
 
 
-def arrange_block(centers, angle):
-    """重新排列单元格中心点的顺序
-    使之按照题目要求，从左上角开始，行列排序
-    OpenCV识别结果在正直状态下默认顺序即为正确顺序
-    旋转 +-45° 时，需要重新排列，对此直接分类，减少计算量
+def rect_min_extent(max_aspect, tol):
+    """能通过 is_square 的矩形，面积与正外接矩形面积之比的下限
+
+    is_square 不限制长宽比，只要求面积不低于最小外接矩形的 1 - tol。边长比为 r 的矩形
+    旋转 45° 时正外接矩形最大，extent 为 2r / (1 + r)^2，再乘 1 - tol；长宽比大于
+    max_aspect 的矩形旋转 45° 时可能被 extent 剔除，轴对齐时本来就会被 max_aspect 剔除。
 
     Args:
-        centers (_type_): 坐标列表
+        max_aspect (float): 允许的矩形边长比
+        tol (float): is_square 的 tol
 
     Returns:
-        _type_: 排序好的坐标列表
+        float: min_extent
+    """
+    return (1 - tol) * 2 * max_aspect / (1 + max_aspect) ** 2
+
+
+# 方格按 find_field_pyramid 用到的最宽松的 is_square（tol=0.15）计算，边长比 3 以内的矩形
+# 不会在第一级被剔除；能通过 is_circle 的轮廓 extent 不低于 0.55，长宽比不超过 1.8
+field_filter = CandidateFilter(
+    min_area=1000, min_extent=rect_min_extent(3, 0.15), max_aspect=3
+)
+piece_filter = CandidateFilter(min_area=1000, min_extent=0.5, max_aspect=2)
+
+
+# 棋盘坐标系：格子 (行, 列) 的中心在 (列 + 0.5, 行 + 0.5)，整个棋盘为 [0, 3] x [0, 3]
+BOARD_CENTERS = np.float32(
+    [[(c + 0.5, r + 0.5) for r in range(3) for c in range(3)]]
+).reshape(1, 9, 2)
+# 0 / 2 / 8 / 6 号格子，四个角按图像中的角度递增排列
+_CORNER_IDX = [0, 2, 8, 6]
+# 两个角与 (1, 1) 方向的夹角相差不到此值（旋转在 45° ± 2° 以内）时视为等距
+TIE_ANGLE = np.radians(4)
+
+
+class BoardModel:
+    """棋盘模型，用单应矩阵描述棋盘坐标系到图像的映射
+
+    格子中心、采样点、正视图都由同一个矩阵一次算出，与棋盘旋转多少无关。
+    0 号格子是离图像右下方向 (1, 1) 最近的角上的格子，第一行沿角度增大的方向
+    （正放时从右往左），与 OpenCV 在正放棋盘上给出的轮廓顺序一致。
+    旋转接近 45° 时两个角与 (1, 1) 几乎等距，夹角相差不到 TIE_ANGLE 时取图像中更靠下的那个，
+    保证 ±45° 的同一画面编号确定，不随检测误差跳变。
+
+    Args:
+        homography (np.ndarray): 3x3，棋盘坐标到图像坐标
+    """
+
+    def __init__(self, homography):
+        self.homography = np.asarray(homography, np.float64)
+
+    @classmethod
+    def from_centers(cls, centers):
+        """由 9 个无序的格子中心拟合
+
+        先用四个角的格子求初值、定下顺序，再把 9 个点按最近的预测位置配对，
+        用全部 9 个点最小二乘拟合。
+
+        Returns:
+            BoardModel | None: 点数不对或配对失败时返回 None
+        """
+        pts = np.asarray(centers, np.float32).reshape(-1, 2)
+        if not len(pts) == 9:
+            return None
+        offset = pts - pts.mean(axis=0)
+        corners = np.argsort((offset**2).sum(axis=1))[-4:]
+        angles = np.arctan2(offset[corners, 1], offset[corners, 0])
+        # 与右下方向 (1, 1) 的夹角，最近的两个角几乎等距时取更靠下的
+        gap = np.abs((angles - np.pi / 4 + np.pi) % (2 * np.pi) - np.pi)
+        near = np.argsort(gap)[:2]
+        first = near[0]
+        if gap[near[1]] - gap[near[0]] < TIE_ANGLE:
+            first = near[np.argmax(offset[corners[near], 1])]
+        order = corners[np.argsort((angles - angles[first]) % (2 * np.pi))]
+        initial = cv.getPerspectiveTransform(BOARD_CENTERS[0, _CORNER_IDX], pts[order])
+        predicted = cv.perspectiveTransform(BOARD_CENTERS, initial)[0]
+        match = np.argmin(((predicted[:, None] - pts[None]) ** 2).sum(axis=2), axis=1)
+        if len(set(match.tolist())) != 9:
+            return None
+        homography, _ = cv.findHomography(BOARD_CENTERS[0], pts[match], 0)
+        return cls(homography if homography is not None else initial)
+
+    @classmethod
+    def from_rect(cls, rect):
+        """由整个棋盘的 cv.minAreaRect 构造，格子顺序与 neu.find_field 原来的循环一致"""
+        (x, y), (w, h), angle = rect
+        angle = np.radians(angle if angle < 45 else angle - 90)
+        cos, sin = np.cos(angle), np.sin(angle)
+        # 平移到中心 @ 旋转 @ 按格子大小缩放 @ 棋盘中心移到原点
+        homography = (
+            np.array([[1, 0, x], [0, 1, y], [0, 0, 1]])
+            @ np.array([[cos, -sin, 0], [sin, cos, 0], [0, 0, 1]])
+            @ np.array([[w / 3, 0, 0], [0, h / 3, 0], [0, 0, 1]])
+            @ np.array([[1, 0, -1.5], [0, 1, -1.5], [0, 0, 1]])
+        )
+        return cls(homography)
+
+    def transform(self, points):
+        """棋盘坐标 (N, 2) 映射到图像坐标"""
+        pts = np.asarray(points, np.float32).reshape(1, -1, 2)
+        return cv.perspectiveTransform(pts, self.homography)[0]
+
+    def centers(self):
+        """9 个格子中心，(9, 2) int32，按格子序号排列"""
+        return self.transform(BOARD_CENTERS).astype(np.int32)
+
+    def sample_points(self, k=3, spread=0.3):
+        """每个格子中心附近 k x k 个采样点，(9, k * k, 2) float32
+
+        Args:
+            k (int, optional): 每边的点数. Defaults to 3.
+            spread (float, optional): 采样范围占格子边长的比例. Defaults to 0.3.
+        """
+        steps = (np.arange(k) - (k - 1) / 2) * (spread / max(k - 1, 1))
+        du, dv = np.meshgrid(steps, steps)
+        grid = np.stack([du.ravel(), dv.ravel()], axis=1)
+        pts = BOARD_CENTERS[0][:, None] + grid[None]
+        return self.transform(pts.reshape(-1, 2)).reshape(9, k * k, 2)
+
+    def warp(self, image, cell=20, dst=None):
+        """把棋盘拉成正视的 (3 * cell, 3 * cell) 小图，格子 (r, c) 在 [r*cell:(r+1)*cell, c*cell:(c+1)*cell]"""
+        scale = np.diag([1 / cell, 1 / cell, 1])
+        return cv.warpPerspective(
+            image,
+            self.homography @ scale,
+            (3 * cell, 3 * cell),
+            dst=dst,
+            flags=cv.INTER_LINEAR | cv.WARP_INVERSE_MAP,
+        )
+
+
+class FrameContext:
+    """一帧的公共预处理，灰度图每帧只转换一次
+
+    模糊、阈值、腐蚀的结果写进预分配的整帧缓冲区（或其中的一块），
+    传入 ctx 的检测函数不再各自 cvtColor / GaussianBlur，返回值与不传时一致。
+
+    Args:
+        shape (tuple, optional): 帧的 (高, 宽). Defaults to (480, 640).
     """
-    if not len(centers) == 9:
-        return []
-    centers = np.array(centers)
-    vec01 = centers[1] - centers[0]
-    vec02 = centers[2] - centers[0]
-    angle201 = vector_angle(vec02, vec01)
-    # print(f"Angle201: {angle201}")
-    if angle201 < 10:
-        if 60 < angle < 90:
-            centers = [centers[x] for x in [2, 1, 0, 5, 4, 3, 8, 7, 6]]
-            return centers
-        elif angle < 30 or angle == 90:
-            return centers
-    elif 85 < angle201 < 95:
-        if angle > 45:
-            centers = [centers[x] for x in [3, 1, 0, 6, 4, 2, 8, 7, 5]]
-        else:
-            centers = [centers[x] for x in [0, 1, 3, 2, 4, 6, 5, 7, 8]]
-    return centers
+
+    def __init__(self, shape=(480, 640)):
+        self._alloc(shape)
+
+    def _alloc(self, shape):
+        self.shape = shape
+        self.gray = np.empty(shape, np.uint8)
+        self.blur = np.empty(shape, np.uint8)  # 整帧模糊
+        self.region_blur = np.empty(shape, np.uint8)  # 按块单独模糊
+        self.thres = np.empty(shape, np.uint8)
+        self.eroded = np.empty(shape, np.uint8)
+        self._blurred = False
+
+    def update(self, frame):
+        """换到新的一帧"""
+        if frame.shape[:2] != self.shape:
+            self._alloc(frame.shape[:2])
+        cv.cvtColor(frame, cv.COLOR_BGR2GRAY, dst=self.gray)
+        self._blurred = False
+        return self
+
+    def blurred(self):
+        """整帧模糊，同一帧只算一次"""
+        if not self._blurred:
+            cv.GaussianBlur(self.gray, (5, 5), 0, dst=self.blur)
+            self._blurred = True
+        return self.blur
+
+    def blur_region(self, region):
+        """单独模糊灰度图的一块，边界按这一块自身处理，与对切片做模糊结果相同"""
+        return cv.GaussianBlur(
+            self.gray[region], (5, 5), 0, dst=self.region_blur[region]
+        )
+
+
+def _buffer(ctx, name, region):
+    """ctx 中预分配缓冲区的一块，没有 ctx 时返回 None 让 OpenCV 自己分配"""
+    return None if ctx is None else getattr(ctx, name)[region]
 
 
-def find_field(frame):
+_WHOLE = (slice(None), slice(None))
+
+
+def find_field(frame, roi=None, ctx=None, factor=None):
     """查找棋盘
 
     Args:
         frame (cv.Mat): 图片一帧
+        roi (tuple, optional): 只在 (x0, y0, x1, y1) 范围内查找. Defaults to None，整帧查找.
+        ctx (FrameContext, optional): 本帧的公共预处理. Defaults to None.
+        factor (int, optional): 大于 1 时先在缩小 factor 倍的图上找，找不齐再按原分辨率找，
+            见 find_field_pyramid. Defaults to None，用 C.field_pyramid.
 
     Returns:
         _type_: 排序后的中心坐标列表，左右极限的坐标
     """
-    gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
-    gray = cv.GaussianBlur(gray, (5, 5), 0)
+    factor = C.field_pyramid if factor is None else factor
+    if factor > 1:
+        centers, pole = find_field_pyramid(frame, factor, roi, ctx)
+        if len(centers) == 9:
+            return centers, pole
+        # 小图上没有找齐（格子缩得太小、角被像素化），按原分辨率再找一次
+    x0, y0 = 0, 0
+    region = _WHOLE
+    if roi is not None:
+        x0, y0, x1, y1 = roi
+        region = (slice(y0, y1), slice(x0, x1))
+        frame = frame[region]  # 视图，不复制
+    if ctx is None:
+        gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+        gray = cv.GaussianBlur(gray, (5, 5), 0)
+    elif roi is None:
+        gray = ctx.blurred()
+    else:
+        gray = ctx.blur_region(region)
     if np.mean(gray) < 10:
         return [], [-1, -1]
     # cv.imshow("Grayscale", gray)
-    _, thres = cv.threshold(gray, 0, 255, cv.THRESH_BINARY | cv.THRESH_OTSU)
-    thres = cv.erode(thres, None, iterations=2)
+    _, thres = cv.threshold(
+        gray,
+        0,
+        255,
+        cv.THRESH_BINARY | cv.THRESH_OTSU,
+        dst=_buffer(ctx, "thres", region),
+    )
+    thres = cv.erode(thres, None, dst=_buffer(ctx, "eroded", region), iterations=2)
     # cv.imshow("Threshold", thres)
     blocks, _ = cv.findContours(thres, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
     centers = []
     sample = None
-    for idx, block in enumerate(blocks):
-        area = cv.contourArea(block)
-        if area < 1000:
-            continue
-        cx, cy = is_square(block)
-        if cx == -1:
-            continue
+    for block, (cx, cy) in field_filter.select(blocks, is_square):
         centers.append([cx, cy])
         sample = block
-        if C.debug:
-            cv.drawContours(frame, [block], -1, (0, 255, 0), 2)
-            cv.circle(frame, (cx, cy), 5, (0, 0, 255), -1)
-            # cv.imshow("Find Field", frame)
+    centers = [[cx + x0, cy + y0] for cx, cy in centers]
     try:
         (x, y), (w, h), angle = cv.minAreaRect(sample)
     except:
@@ -122,15 +408,131 @@ def find_field(frame):
         # print("Pole:", pole)
     # print(f"Angle: {angle}")
 
-    centers = arrange_block(centers, angle)
+    model = BoardModel.from_centers(centers)
+    if model is None:
+        return [], [-1, -1]
+    centers = model.centers()
+    # 调试绘制见 preview.draw_overlay，在显示线程上进行
+    return centers, pole
+
+
+def find_field_pyramid(frame, factor=2, roi=None, ctx=None):
+    """在缩小的图上查找棋盘，返回值与 find_field 相同
+
+    灰度图按面积缩小 factor 倍（同时起到平滑作用），在小图上阈值、找轮廓，
+    用 field_filter（面积阈值按比例缩小）和 is_square 找出 9 个格子。原分辨率上
+    不再模糊、阈值：格子中心取小图轮廓的矩心（亚像素）换算回原图，由 9 个中心拟合
+    BoardModel，误差不比原分辨率逐格重新定位大。没有找齐 9 个格子时返回空，
+    find_field 会退回原分辨率。
+
+    Args:
+        frame (cv.Mat): 图片一帧
+        factor (int, optional): 缩小倍数. Defaults to 2.
+        roi (tuple, optional): 只在 (x0, y0, x1, y1) 范围内查找. Defaults to None，整帧查找.
+        ctx (FrameContext, optional): 本帧的公共预处理，传入时直接用其中的灰度图. Defaults to None.
 
-    for idx, (cx, cy) in enumerate(centers):
-        cv.putText(
-            frame, str(idx), (cx, cy), cv.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2
+    Returns:
+        _type_: 排序后的中心坐标列表，左右极限的坐标
+    """
+    x0, y0 = 0, 0
+    region = _WHOLE
+    if roi is not None:
+        x0, y0, x1, y1 = roi
+        region = (slice(y0, y1), slice(x0, x1))
+    if ctx is None:
+        gray = cv.cvtColor(frame[region], cv.COLOR_BGR2GRAY)
+    else:
+        gray = ctx.gray[region]
+    small = cv.resize(
+        gray, None, fx=1 / factor, fy=1 / factor, interpolation=cv.INTER_AREA
+    )
+    if factor < 3:
+        small = cv.GaussianBlur(small, (3, 3), 0)
+        square = is_square
+    else:
+        # 缩小 3 倍以上时按面积缩小已经足够平滑；格子只剩十几像素，角被像素化，
+        # 放宽方格判断
+        square = functools.partial(is_square, eps=0.05, tol=0.15)
+    if np.mean(small) < 10:
+        return [], [-1, -1]
+    # 缩小后格子间的缝只有几个像素，不再腐蚀
+    _, thres = cv.threshold(small, 0, 255, cv.THRESH_BINARY | cv.THRESH_OTSU)
+    blocks, _ = cv.findContours(thres, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
+    centers = []
+    sample = None
+    for block, _ in field_filter.select(blocks, square, scale=1 / factor):
+        M = cv.moments(block)
+        # 小图像素 i 覆盖原图 [i * factor, (i + 1) * factor)
+        centers.append(
+            (
+                (M["m10"] / M["m00"] + 0.5) * factor - 0.5 + x0,
+                (M["m01"] / M["m00"] + 0.5) * factor - 0.5 + y0,
+            )
         )
-    # cv.imshow("Find Field", frame)
+        sample = block
+    if not len(centers) == 9:
+        return [], [-1, -1]
+    # 与 find_field 相同，宽度取最后一个格子的外接矩形
+    (_, _), (w, h), _ = cv.minAreaRect(sample)
+    w = w * factor
+    pole = [
+        int(min(centers, key=lambda x: x[0])[0] - w // 2),
+        int(max(centers, key=lambda x: x[0])[0] + w // 2),
+    ]
+    model = BoardModel.from_centers(centers)
+    if model is None:
+        return [], [-1, -1]
+    return model.centers(), pole
 
-    return centers, pole
+
+class FieldTracker:
+    """跟踪棋盘位置，棋盘不动时只在上一次结果附近的 ROI 里查找
+
+    ROI 内的结果必须是 9 个中心且每个都离上一次很近，否则退回整帧查找。
+
+    Args:
+        pad (int, optional): ROI 在棋盘外扩的像素. Defaults to 40.
+        max_shift (int, optional): 两次结果间单个中心允许的最大位移. Defaults to 20.
+    """
+
+    def __init__(self, pad=40, max_shift=20):
+        self.pad = pad
+        self.max_shift = max_shift
+        self.centers = None
+        self.pole = [-1, -1]
+        self.stats = {"roi": 0, "full": 0, "lost": 0}
+
+    def roi(self, shape):
+        """根据上一次的中心计算 ROI，(x0, y0, x1, y1)"""
+        pts = np.array(self.centers)
+        # 三个格子跨两个间距，半个格子约为跨度的 1/4
+        half = int(np.ptp(pts, axis=0).max() / 4) + self.pad
+        x0, y0 = np.maximum(pts.min(axis=0) - half, 0)
+        x1, y1 = np.minimum(pts.max(axis=0) + half, (shape[1], shape[0]))
+        return int(x0), int(y0), int(x1), int(y1)
+
+    def _valid(self, centers):
+        if not len(centers) == 9:
+            return False
+        shift = np.abs(np.array(centers) - np.array(self.centers)).max()
+        return shift <= self.max_shift
+
+    def find(self, frame, ctx=None):
+        """同 find_field，返回排序后的中心坐标列表和左右极限"""
+        if self.centers is not None:
+            centers, pole = find_field(frame, self.roi(frame.shape), ctx)
+            if self._valid(centers):
+                self.stats["roi"] += 1
+                self.centers, self.pole = centers, pole
+                return centers, pole
+        self.stats["full"] += 1
+        centers, pole = find_field(frame, ctx=ctx)
+        if len(centers) == 9:
+            self.centers, self.pole = centers, pole
+        else:
+            self.stats["lost"] += 1
+            self.centers = None
+        return centers, pole
 
 
 def is_circle(contour):
@@ -152,119 +554,221 @@ def is_circle(contour):
     return -1, -1
 
 
-def find_pieces(frame, left=180, right=450):
+def _wing_mask(frame, region, invert, ctx=None):
+    """棋盘一侧的二值图，棋子为白
+
+    Args:
+        frame (cv.Mat): 整帧图片
+        region (tuple): 这一侧的切片
+        invert (bool): 深色棋子时取反
+        ctx (FrameContext, optional): 本帧的公共预处理. Defaults to None.
+    """
+    if ctx is None:
+        gray = cv.cvtColor(frame[region], cv.COLOR_BGR2GRAY)
+        gray = cv.GaussianBlur(gray, (5, 5), 0)
+    else:
+        gray = ctx.blur_region(region)
+    _, thres = cv.threshold(
+        gray,
+        0,
+        255,
+        (cv.THRESH_BINARY_INV if invert else cv.THRESH_BINARY) | cv.THRESH_OTSU,
+        dst=_buffer(ctx, "thres", region),
+    )
+    return cv.erode(thres, None, dst=_buffer(ctx, "eroded", region), iterations=2)
+
+
+def find_pieces(frame, left=180, right=450, ctx=None):
     """截取棋盘两侧ROI，查找棋子
 
     Args:
         frame (_type_): 图片一帧
         left (int, optional): 左侧截取的边界. Defaults to 180.
         right (int, optional): 右侧……. Defaults to 450.
+        ctx (FrameContext, optional): 本帧的公共预处理. Defaults to None.
 
     Returns:
         _type_: 棋子坐标字典，包含黑棋和白棋的坐标列表
     """
     if left < 10 or right > 630:  # 如果ROI不靠谱就直接别算了
         return {"black": [], "white": []}
-    rightwing = frame[:, :left, :]  # white
-    leftwing = frame[:, right:, :]  # black
     pieces = {"black": [], "white": []}
-    gray = cv.cvtColor(leftwing, cv.COLOR_BGR2GRAY)
-    gray = cv.GaussianBlur(gray, (5, 5), 0)
-    _, thres = cv.threshold(gray, 0, 255, cv.THRESH_BINARY_INV | cv.THRESH_OTSU)
-    thres = cv.erode(thres, None, iterations=2)
+    # 右侧为黑棋，左侧为白棋
+    thres = _wing_mask(frame, (slice(None), slice(right, None)), True, ctx)
     cnts, _ = cv.findContours(thres, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
-    for idx, cnt in enumerate(cnts):
-        area = cv.contourArea(cnt)
-        if area < 1000 or not is_circle(cnt):
-            continue
-        cx, cy = is_circle(cnt)
-        if cx == -1:
-            continue
-        pieces["black"].append([cx, cy])
-        if C.debug:
-            cv.drawContours(leftwing, [cnt], -1, (0, 255, 0), 2)
-            cv.circle(leftwing, (cx, cy), 5, (0, 0, 255), -1)
-            # cv.imshow("left", leftwing)
-    # cv.imshow("left thres", thres)
-
-    gray = cv.cvtColor(rightwing, cv.COLOR_BGR2GRAY)
-    gray = cv.GaussianBlur(gray, (5, 5), 0)
-    # cv.imshow("Gray", gray)
-    _, thres = cv.threshold(gray, 0, 255, cv.THRESH_BINARY | cv.THRESH_OTSU)
-    thres = cv.erode(thres, None, iterations=2)
+    for cnt, (cx, cy) in piece_filter.select(cnts, is_circle):
+        pieces["black"].append([cx + right, cy])
+
+    thres = _wing_mask(frame, (slice(None), slice(None, left)), False, ctx)
     cnts, _ = cv.findContours(thres, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
-    for idx, cnt in enumerate(cnts):
-        area = cv.contourArea(cnt)
-        if area < 1000 or not is_circle(cnt):
-            continue
-        cx, cy = is_circle(cnt)
-        if cx == -1:
-            continue
+    for cnt, (cx, cy) in piece_filter.select(cnts, is_circle):
         pieces["white"].append([cx, cy])
-        if C.debug:
-            cv.drawContours(rightwing, [cnt], -1, (0, 255, 0), 2)
-            cv.circle(rightwing, (cx, cy), 5, (0, 0, 255), -1)
-            # cv.imshow("right", rightwing)
-    # cv.imshow("right thres", thres)
     pieces["black"] = sorted(pieces["black"], key=lambda x: x[1])
     pieces["white"] = sorted(pieces["white"], key=lambda x: x[1])
-    pieces["black"] = [
-        [pieces["black"][x][0] + right, pieces["black"][x][1]]
-        for x in range(len(pieces["black"]))
-    ]
-    if C.debug:
-        for idx, piece in enumerate(pieces["black"]):
-            cv.putText(
-                leftwing,
-                str(idx),
-                (piece[0], piece[1]),
-                cv.FONT_HERSHEY_SIMPLEX,
-                1,
-                (128, 128, 255),
-                2,
-            )
-        for idx, piece in enumerate(pieces["white"]):
-            cv.putText(
-                rightwing,
-                str(idx),
-                (piece[0], piece[1]),
-                cv.FONT_HERSHEY_SIMPLEX,
-                1,
-                (128, 128, 255),
-                2,
+    return pieces
+
+
+def find_pieces_cc(frame, left=180, right=450, ctx=None, step=2):
+    """同 find_pieces，在缩小的二值图上用连通域代替轮廓
+
+    棋子是大块孤立的圆，缩小 step 倍后仍有十几像素的半径。每一侧的灰度图先按面积
+    缩小（同时起到平滑作用），阈值、腐蚀和一次 connectedComponentsWithStats 都在
+    小图上完成，得到所有色块的面积、外接矩形和质心；按 piece_filter 的阈值批量筛选，
+    只对剩下的几个色块取轮廓做 is_circle 判断。坐标为质心乘回 step，误差约 1 像素。
+
+    Args:
+        frame (_type_): 图片一帧
+        left (int, optional): 左侧截取的边界. Defaults to 180.
+        right (int, optional): 右侧……. Defaults to 450.
+        ctx (FrameContext, optional): 本帧的公共预处理，传入时直接用其中的灰度图. Defaults to None.
+        step (int, optional): 缩小倍数，1 时不缩小. Defaults to 2.
+
+    Returns:
+        _type_: 棋子坐标字典，包含黑棋和白棋的坐标列表
+    """
+    if left < 10 or right > 630:
+        return {"black": [], "white": []}
+    pieces = {}
+    for key, region, invert, x0 in (
+        ("black", (slice(None), slice(right, None)), True, right),
+        ("white", (slice(None), slice(None, left)), False, 0),
+    ):
+        if ctx is None:
+            gray = cv.cvtColor(frame[region], cv.COLOR_BGR2GRAY)
+        else:
+            gray = ctx.gray[region]
+        if step > 1:
+            gray = cv.resize(
+                gray, None, fx=1 / step, fy=1 / step, interpolation=cv.INTER_AREA
             )
-        # cv.imshow("right", rightwing)
+        gray = cv.GaussianBlur(gray, (3, 3), 0)
+        _, thres = cv.threshold(
+            gray,
+            0,
+            255,
+            (cv.THRESH_BINARY_INV if invert else cv.THRESH_BINARY) | cv.THRESH_OTSU,
+        )
+        # 与 find_pieces 的两次腐蚀对应
+        thres = cv.erode(thres, None, iterations=max(1, 2 // step))
+        _, labels, stats, centroids = cv.connectedComponentsWithStatsWithAlgorithm(
+            thres, 8, cv.CV_32S, cv.CCL_GRANA
+        )
+        found = piece_filter.select_blobs(
+            labels, stats, centroids, is_circle, scale=1 / step
+        )
+        pieces[key] = sorted(
+            (
+                [int(cx * step + (step - 1) / 2) + x0, int(cy * step + (step - 1) / 2)]
+                for cx, cy in found
+            ),
+            key=lambda x: x[1],
+        )
     return pieces
 
 
+PIECE_DETECTORS = {"contour": find_pieces, "cc": find_pieces_cc}
+
+
+def get_piece_detector(name=None):
+    """按名字取棋子识别函数
+
+    Args:
+        name (str, optional): "contour" 或 "cc". Defaults to None，用 C.piece_detector.
+    """
+    name = name or C.piece_detector
+    if name not in PIECE_DETECTORS:
+        raise ValueError(f"Unknown piece detector: {name}")
+    return PIECE_DETECTORS[name]
+
+
 blocks_center = []
 
+LIGHT = 1
+DARK = -1
+
+
+def classify_cells(gray, centers, half=6, stat="median", light=210, dark=100):
+    """一次取出 9 个格子中心的小块，统一计算亮度并分类
+
+    Args:
+        gray (np.ndarray): 灰度图
+        centers (array-like): 9 个格子中心 (x, y)，按格子序号排列
+        half (int, optional): 小块的半边长，像素. Defaults to 6.
+        stat (str, optional): "median"、"trimmed"（去掉最亮最暗各 10% 后的均值）或 "mean". Defaults to "median".
+        light (int, optional): 亮度高于此值为浅色棋子. Defaults to 210.
+        dark (int, optional): 亮度低于此值为深色棋子. Defaults to 100.
+
+    Returns:
+        tuple: ((3, 3) int8，LIGHT / DARK / 0；(3, 3) float32 置信度 0~1，离阈值越远越高)
+    """
+    pts = np.asarray(centers, np.intp).reshape(9, 2)
+    offsets = np.arange(-half, half)
+    h, w = gray.shape[:2]
+    ys = np.clip(pts[:, 1, None, None] + offsets[None, :, None], 0, h - 1)
+    xs = np.clip(pts[:, 0, None, None] + offsets[None, None, :], 0, w - 1)
+    patches = gray[ys, xs].reshape(9, -1)  # (9, 4 * half * half)，一次取出
+    if stat == "median":
+        value = np.median(patches, axis=1)
+    elif stat == "trimmed":
+        cut = patches.shape[1] // 10
+        value = np.sort(patches, axis=1)[:, cut : patches.shape[1] - cut].mean(axis=1)
+    elif stat == "mean":
+        value = patches.mean(axis=1)
+    else:
+        raise ValueError(f"Unknown stat: {stat}")
+    cells = np.where(value > light, LIGHT, np.where(value < dark, DARK, 0))
+    confidence = np.select(
+        [cells == LIGHT, cells == DARK],
+        [(value - light) / (255 - light), (dark - value) / dark],
+        np.minimum(value - dark, light - value) / ((light - dark) / 2),
+    )
+    return (
+        cells.astype(np.int8).reshape(3, 3),
+        np.clip(confidence, 0, 1).astype(np.float32).reshape(3, 3),
+    )
+
+
+def read_cells(frame, me, ctx=None, gray=None, centers=None):
+    """读取棋盘状态，NumPy 版本
+
+    Args:
+        frame (cv.Mat): 图片
+        me (int): 我的棋子颜色（表现为任务编号），4 时浅色为 X，5 时浅色为 O
+        ctx (FrameContext, optional): 本帧的公共预处理，传入时直接用其中的灰度图. Defaults to None.
+        gray (np.ndarray, optional): 已经算好的灰度图. Defaults to None.
+        centers (array-like, optional): 9 个格子中心. Defaults to None，用 blocks_center.
+
+    Returns:
+        tuple: ((3, 3) int8 棋盘，0 空、-1 X、1 O；(3, 3) float32 置信度)
+    """
+    if ctx is not None:
+        gray = ctx.gray
+    elif gray is None:
+        gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+    if centers is None:
+        centers = blocks_center
+    if not len(centers) == 9:
+        return np.zeros((3, 3), np.int8), np.zeros((3, 3), np.float32)
+    cells, confidence = classify_cells(gray, centers)
+    light_piece = (
+        -1 if me == 4 else 1
+    )  # 与 py_tic_tac_toe.game.board_to_array 相同，X 为 -1
+    board = (cells * (light_piece * LIGHT)).astype(np.int8)
+    return board, confidence
+
 
-def read_board(frame, me):
+def read_board(frame, me, ctx=None, gray=None):
     """根据棋盘坐标读取棋盘状态
 
     Args:
         frame (_type_): 图片
         me (_type_): 我的棋子颜色（表现为任务编号）
+        ctx (FrameContext, optional): 本帧的公共预处理，传入时直接用其中的灰度图. Defaults to None.
+        gray (np.ndarray, optional): 已经算好的灰度图. Defaults to None.
 
     Returns:
         _type_: 棋盘状态数组
     """
-    global blocks_center
-    gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
-    cv.imshow("Gray", gray)
-    board = [[" " for i in range(3)] for j in range(3)]
-    if me == 4:
-        ego = "X"
-        tu = "O"
-    elif me == 5:
-        ego = "O"
-        tu = "X"
-    for idx, block in enumerate(blocks_center):
-        color = gray[block[1], block[0]]
-        # print("Color: ", color)
-        if color > 210:
-            board[idx // 3][idx % 3] = ego
-        elif color < 100:
-            board[idx // 3][idx % 3] = tu
-    return board
+    board, _ = read_cells(frame, me, ctx, gray)
+    piece = {-1: "X", 1: "O"}
+    return [[piece.get(int(cell), " ") for cell in row] for row in board]
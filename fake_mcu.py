@@ -0,0 +1,196 @@
+"""
+filename: fake_mcu.py
+author: Neolux Lee
+created: 2026-10-18
+last modified: 2026-10-18
+descrip: 内存里的假下位机，按波特率模拟串口传输，没有 USB 转串口也能联调和测速
+version: 1.0
+copyright: © 2024 N.K.F.Lee
+"""
+
+import threading
+import time
+from collections import deque
+
+from protocol import PacketParser, encode_command
+
+
+class _Line:
+    """单向的一根串口线，按波特率计算每段数据到达对端的时刻
+
+    Args:
+        baud (int): 波特率，按 8N1 每字节 10 位
+        buffer (int, optional): 发送缓冲区字节数，积压超过时 write 阻塞. Defaults to 4096.
+    """
+
+    def __init__(self, baud, buffer=4096):
+        self.byte_time = 10 / baud
+        self.buffer = buffer
+        self.closed = False
+        self._cond = threading.Condition()
+        self._chunks = deque()  # (到达时刻, 数据)，还在线上
+        self._busy_until = 0.0  # 线上最后一个字节发完的时刻
+        self._rx = bytearray()  # 已到达、还没被读走
+
+    def send(self, data):
+        with self._cond:
+            limit = self.buffer * self.byte_time
+            now = time.monotonic()
+            while self._busy_until - now > limit and not self.closed:
+                self._cond.wait(self._busy_until - now - limit)
+                now = time.monotonic()
+            start = max(now, self._busy_until)
+            self._busy_until = start + len(data) * self.byte_time
+            self._chunks.append((self._busy_until, bytes(data)))
+            self._cond.notify_all()
+        return len(data)
+
+    def _arrive(self, now):
+        while self._chunks and self._chunks[0][0] <= now:
+            self._rx += self._chunks.popleft()[1]
+
+    def available(self):
+        with self._cond:
+            self._arrive(time.monotonic())
+            return len(self._rx)
+
+    def receive(self, size, timeout=None):
+        """读最多 size 字节，至少有 1 字节、超时或关闭时返回"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._arrive(now)
+                if self._rx or self.closed:
+                    break
+                wait = self._chunks[0][0] - now if self._chunks else None
+                if deadline is not None:
+                    if now >= deadline:
+                        break
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._cond.wait(wait)
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+            return data
+
+    def drain(self):
+        """等到已写入的数据全部到达对端"""
+        with self._cond:
+            while not self.closed:
+                wait = self._busy_until - time.monotonic()
+                if wait <= 0:
+                    break
+                self._cond.wait(wait)
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class LoopbackSerial:
+    """上位机这一端，接口与 serial.Serial 相同的部分
+
+    Args:
+        mcu (FakeMCU): 对端
+        timeout (float, optional): read 的超时，秒. Defaults to None，阻塞到有数据.
+    """
+
+    def __init__(self, mcu, timeout=None):
+        self.mcu = mcu
+        self.timeout = timeout
+        self.baudrate = mcu.baud
+
+    @property
+    def in_waiting(self):
+        return self.mcu.to_host.available()
+
+    @property
+    def is_open(self):
+        return not self.mcu.to_host.closed
+
+    def read(self, size=1):
+        return self.mcu.to_host.receive(size, self.timeout)
+
+    def read_all(self):
+        return self.mcu.to_host.receive(self.in_waiting, 0)
+
+    def write(self, data):
+        return self.mcu.to_mcu.send(data)
+
+    def close(self):
+        self.mcu.close()
+
+
+class FakeMCU:
+    """假下位机：解析上位机发来的数据包，记录棋盘状态，可以按协议发出指令
+
+    收到落子时记录从最近一条指令发出到落子数据包完整到达的时间。
+
+    Args:
+        baud (int, optional): 波特率. Defaults to 9600.
+        on_packet (function, optional): on_packet(mcu, packet)，每个数据包到达后调用，
+            可以在里面回复指令. Defaults to None.
+    """
+
+    def __init__(self, baud=9600, on_packet=None):
+        self.baud = baud
+        self.on_packet = on_packet
+        self.to_mcu = _Line(baud)
+        self.to_host = _Line(baud)
+        self.host = LoopbackSerial(self)
+        self.parser = PacketParser()
+        self.field = {}  # 序号 -> (x, y)
+        self.pieces = {}  # (颜色, 序号) -> (x, y)
+        self.moves = []  # 收到的落子位置
+        self.results = []  # 收到的胜负结果
+        self.cheats = []  # 收到的 (旧位置, 新位置)
+        self.latencies = []  # 指令发出到收到落子，秒
+        self.counts = {}  # 每种数据包的个数
+        self._cmd_time = None
+        self._moved = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="fake-mcu", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self.to_mcu.closed:
+            data = self.to_mcu.receive(256, timeout=0.1)
+            for packet in self.parser.feed(data):
+                self._handle(packet)
+
+    def _handle(self, packet):
+        self.counts[packet.kind] = self.counts.get(packet.kind, 0) + 1
+        if packet.kind == "field":
+            idx, x, y = packet.args
+            self.field[idx] = (x, y)
+        elif packet.kind == "piece":
+            color, idx, x, y = packet.args
+            self.pieces[(color, idx)] = (x, y)
+        elif packet.kind == "move":
+            with self._moved:
+                if self._cmd_time is not None:
+                    self.latencies.append(time.monotonic() - self._cmd_time)
+                    self._cmd_time = None
+                self.moves.append(packet.args[0])
+                self._moved.notify_all()
+        elif packet.kind == "winner":
+            self.results.append(packet.args[0])
+        elif packet.kind == "cheat":
+            self.cheats.append(packet.args)
+        if self.on_packet is not None:
+            self.on_packet(self, packet)
+
+    def command(self, cmd):
+        """发出一条指令（protocol.TASK_4 等），开始计时"""
+        with self._moved:
+            self._cmd_time = time.monotonic()
+        self.to_host.send(encode_command(cmd))
+
+    def wait_move(self, count, timeout=None):
+        """等到一共收到 count 次落子，超时返回 False"""
+        with self._moved:
+            return self._moved.wait_for(lambda: len(self.moves) >= count, timeout)
+
+    def close(self):
+        self.to_mcu.close()
+        self.to_host.close()
@@ -1,21 +1,208 @@
 import cv2 as cv
 import numpy as np
 import time, datetime
-
-from serial import Serial
+import threading
 
 import config as C
 from config import ErrCode
-from ThreadingCam import ThreadCap
-from py_tic_tac_toe.game import best_move, decide_win, anti_cheat
-from detection import find_field, find_pieces, read_board
-from transmission import ser, send_field, send_pieces, notify_winner, notify_cheat, ByteArray
+from ThreadingCam import ThreadCap, next_frame
+from py_tic_tac_toe.game import decide_win, build_table
+from py_tic_tac_toe.tracker import GameTracker
+import detection
+from detection import (
+    find_field,
+    get_piece_detector,
+    read_board,
+    FieldTracker,
+    FrameContext,
+    field_filter,
+    piece_filter,
+)
+from motion import FrameGate
+from protocol import CommandReader
+from pipeline import Pipeline
+from profiler import profiler
+import preview
+import transmission
+from transmission import (
+    open_serial,
+    send_frame,
+    send_move,
+    notify_winner,
+    notify_cheat,
+)
 
+ser = None
 
-def main():
-    if C.threading_cam:
-        cap = ThreadCap(camera_index=C.cam_id, width=640, height=480, fps=120)
-    else:
+
+def play_turn(cmd, frame, tracker, ctx=None, gray=None, stamp_ns=None):
+    """处理一条任务指令：读棋盘、防作弊、判胜负、落子
+
+    Args:
+        cmd (Command): 串口收到的指令
+        frame (cv.Mat): 收到指令时的一帧
+        tracker (GameTracker): 对局跟踪
+        ctx (FrameContext, optional): 本帧的公共预处理. Defaults to None.
+        gray (np.ndarray, optional): 已经算好的灰度图. Defaults to None.
+        stamp_ns (int, optional): 取到这一帧的时刻，用于计时. Defaults to None.
+
+    Returns:
+        str: "ignored" 不是任务指令，"cheat" 发现作弊，"over" 对局已结束，
+            "retry" 没能给出落子，"moved" 已经落子
+    """
+    if cmd is None or cmd.kind != "task":
+        return "ignored"
+    with profiler.stage("read_board"):
+        board = read_board(frame, cmd.code, ctx, gray)
+    print("Board:\n", board)
+    print("Last Board: \n", tracker.board)
+    event = tracker.observe(board)
+    if event.kind == "move" and event.player == "O":
+        print("Anti-cheat detected: ", event.old, "->", event.new)
+        notify_cheat(event.old, event.new)
+        return "cheat"
+    if event.kind not in ("none", "add"):
+        tracker.sync(board)  # 与跟踪的局面对不上时以识别结果为准
+    winner = decide_win(board)
+    # print("Winner 1: ", winner)
+    if winner == -1:
+        notify_winner("human")  # 人类获胜
+    elif winner == 3:
+        notify_winner("draw")  # 平局
+    elif winner == 0:  # 不确定结果
+        with profiler.stage("best_move"):
+            bm = tracker.best_move()
+        print(bm)
+        if bm is None:
+            return "retry"
+        board[bm[0]][bm[1]] = "O"
+        tracker.play(bm, "O")
+        send_move(bm[0] * 3 + bm[1], stamp_ns)
+        winner = decide_win(board)  # 再次检查是否结束
+        if winner == 1:
+            notify_winner("computer")
+        elif winner == 3:
+            notify_winner("draw")
+        # board[bm[0]][bm[1]] = " "
+        return "moved"
+    return "over"
+
+
+def run_pipeline(cap, reader):
+    """流水线模式：取帧、识别、对局逻辑各占一个线程，显示留在主线程
+
+    Args:
+        cap: 帧来源
+        reader (CommandReader): 串口指令
+
+    Returns:
+        int: 返回值
+    """
+    tracker = GameTracker()
+    field_tracker = FieldTracker()
+    local = threading.local()  # 多个识别线程各用各的 FrameContext
+    state = {"failed_to_decide": False, "cmd": None, "overwritten": 0}
+    find_pieces = get_piece_detector()
+
+    def detect(packet):
+        if not hasattr(local, "ctx"):
+            local.ctx = FrameContext()
+        ctx = local.ctx.update(packet.frame)
+        packet.gray = ctx.gray.copy()  # 缓冲区会被下一帧覆盖，对局逻辑要用的留一份
+        frame = packet.frame
+        # FieldTracker 有状态，只有一个识别线程时才用
+        with profiler.stage("find_field"):
+            if C.track_field and C.detect_workers == 1:
+                centers, pole = field_tracker.find(frame, ctx)
+            else:
+                centers, pole = find_field(frame, ctx=ctx)
+        with profiler.stage("find_pieces"):
+            pieces = (
+                find_pieces(frame, pole[0], pole[1], ctx) if not pole[0] == -1 else None
+            )
+        if packet.cap_seq is not None and not cap.valid(packet.cap_seq):
+            # 识别期间视图所在槽位已被新画面覆盖，结果不可信，当作没识别到
+            centers, pole, pieces = [], [-1, -1], None
+            state["overwritten"] += 1
+        packet.centers, packet.pole, packet.pieces = centers, pole, pieces
+
+    def logic(packet):
+        send_frame(packet.centers, packet.pieces, packet.stamp_ns)
+        if len(packet.centers) == 9:
+            detection.blocks_center = packet.centers
+        if not (reader.pending() or state["failed_to_decide"]):
+            return
+        if not state["failed_to_decide"]:
+            state["cmd"] = reader.poll()
+        print("Cmd: ", state["cmd"])
+        status = play_turn(
+            state["cmd"],
+            packet.frame,
+            tracker,
+            gray=packet.gray,
+            stamp_ns=packet.stamp_ns,
+        )
+        if status == "retry":
+            state["failed_to_decide"] = True
+        elif status == "moved":
+            state["failed_to_decide"] = False
+
+    t0 = time.perf_counter()
+    fc = 0
+
+    view = preview.from_config()
+
+    def display(packet):
+        nonlocal t0, fc
+        fc += 1
+        with profiler.stage("preview"):
+            view.submit(packet.frame, packet.centers, packet.pole, packet.pieces)
+        if view.closed:
+            return False
+        t1 = time.perf_counter()
+        if t1 - t0 > 1:
+            print(f"FPS: {fc / (t1 - t0):.2f}")
+            print("Pipeline:", pipe.stats(), "overwritten:", state["overwritten"])
+            if profiler.enabled:
+                print(profiler.report())
+            fc = 0
+            t0 = t1
+        return True
+
+    pipe = Pipeline(
+        cap,
+        [("detect", detect, C.detect_workers), ("logic", logic, 1)],
+        display,
+    )
+    pipe.run()
+    view.close()
+    cap.release()
+    reader.close()
+    transmission.transport.close()
+    profiler.export(C.profile_json, C.profile_trace)
+    return 0
+
+
+def main(cap=None, serial=None, reader=None):
+    """主程序
+
+    Args:
+        cap (optional): 帧来源，需要有 read / isOpened / release. Defaults to None，打开摄像头.
+        serial (optional): 串口，需要有 in_waiting / read_all / write. Defaults to None，打开 C.serial_port.
+        reader (optional): 指令来源，需要有 pending / poll / close，回放时按帧号同步投递.
+            Defaults to None，后台线程读 serial.
+
+    Returns:
+        int: 返回值，见 ErrCode
+    """
+    build_table()  # 提前建好走法表，收到指令时只需查表
+    if cap is None and C.threading_cam:
+        # 流水线里第一级队列 2 帧加上正在识别的帧都持有视图，槽位要留足
+        slots = 2 * (C.detect_workers + 2) + 2 if C.pipeline else 4
+        cap = ThreadCap(
+            camera_index=C.cam_id, width=640, height=480, fps=120, slots=slots
+        )
+    elif cap is None:
         cap = cv.VideoCapture(C.cam_id)
         cap.set(cv.CAP_PROP_FRAME_WIDTH, 640)
         cap.set(cv.CAP_PROP_FRAME_HEIGHT, 480)
@@ -25,95 +212,129 @@ def main():
         print("Fatal: Camera not opened")
         return ErrCode.CAM_NO_OPENED
     global ser
-    ser = Serial(C.serial_port, C.serial_baud)
+    ser = serial if serial is not None else open_serial(C.serial_port, C.serial_baud)
     # ser = None
+    delta = (
+        transmission.DeltaSender(C.delta_tolerance, C.delta_refresh, C.tx_budget)
+        if C.delta_tx
+        else None
+    )
+    transmission.bind(ser, delta_sender=delta)  # 发送走后台队列，不阻塞识别循环
+    if reader is None:
+        reader = CommandReader(ser)  # 接收也在后台线程上，指令不会因为帧率而延迟或丢失
     failed_to_decide = False
+    if C.pipeline:
+        return run_pipeline(cap, reader)
     if C.debug:
         fc = 0  # frame count
         t0 = datetime.datetime.now()
         last_pole = [-1, -1]
-        last_board = None
+        tracker = GameTracker()
+        field_tracker = FieldTracker()
+        ctx = FrameContext()
+        gate = FrameGate()
+        find_pieces = get_piece_detector()
+        view = preview.from_config()  # 绘制和显示在单独的线程上
+        last_seq = -1
         while True:
-            ret, frame = cap.read()
-            fm = frame.copy() if not frame is None else None
+            with profiler.stage("capture"):
+                # ThreadCap 取只读视图不拷贝，识别不在画面上绘制，read_board 用 ctx 的灰度图；
+                # 画面静止时拿到的是上一帧，照常处理指令
+                ret, frame, last_seq = next_frame(cap, last_seq)
             if not ret:
+                if getattr(cap, "exhausted", False):  # 回放结束
+                    break
                 print("Fatal: No frame got")
-                if C.threading_cam:
+                if hasattr(cap, "read_next"):  # ThreadCap 还没有采到第一帧
                     continue
                 else:
                     return ErrCode.NO_FRAME_GOT
             fc += 1
-            centers, pole = find_field(frame)
-            send_field(centers)
-            pieces = find_pieces(frame, pole[0], pole[1]) if not pole[0] == -1 else None
-            # if pole[0] == -1:
-            #      pole = last_pole
-            # pieces = find_pieces(frame, pole[0], pole[1]) if not pole[0] == -1 else None
-            send_pieces(pieces)
-
-            if ser.in_waiting > 0 or failed_to_decide:
+            stamp_ns = time.perf_counter_ns()  # 取到这一帧的时刻，一路带到串口写出
+            pending = reader.pending() or failed_to_decide
+            if pending:
+                gate.invalidate()  # 收到指令的这一帧一定重新识别
+
+            def detect(frame):
+                # 灰度图算一次，识别和 read_board 共用
+                ctx.update(frame)
+                with profiler.stage("find_field"):
+                    centers, pole = (
+                        field_tracker.find(frame, ctx)
+                        if C.track_field
+                        else find_field(frame, ctx=ctx)
+                    )
+                with profiler.stage("find_pieces"):
+                    pieces = (
+                        find_pieces(frame, pole[0], pole[1], ctx)
+                        if not pole[0] == -1
+                        else None
+                    )
+                # if pole[0] == -1:
+                #      pole = last_pole
+                # pieces = find_pieces(frame, pole[0], pole[1]) if not pole[0] == -1 else None
+                return centers, pole, pieces
+
+            if C.gate_frames:
+                (centers, pole, pieces), fresh = gate.process(frame, detect)
+            else:
+                (centers, pole, pieces), fresh = detect(frame), True
+            if fresh:  # 静止画面不再重复发送相同的坐标
+                send_frame(centers, pieces, stamp_ns)  # 格子和棋子合并为一次写出
+            if len(centers) == 9:
+                detection.blocks_center = centers  # read_board 按最近一次的格子中心取样
+
+            if pending:
                 if not failed_to_decide:
-                    cmd = ser.read_all()
+                    cmd = reader.poll()
                 print("Cmd: ", cmd)
-                if cmd == b"4":
-                    board = read_board(fm, 4)
-                elif cmd == b"5":
-                    board = read_board(fm, 5)
-                else:
-                    continue
-                print("Board:\n", board)
-                print("Last Board: \n", last_board)
-                if not last_board is None:
-                    ret, old_pos, new_pos = anti_cheat(last_board, board)
-                    if ret:
-                        print("Anti-cheat detected: ", old_pos, "->", new_pos)
-                        notify_cheat(old_pos, new_pos)
-                        continue
-                last_board = board
-                winner = decide_win(board)
-                # print("Winner 1: ", winner)
-                if winner == -1:
-                    notify_winner("human")  # 人类获胜
-                elif winner == 3:
-                    notify_winner("draw")  # 平局
-                elif winner == 0:  # 不确定结果
-                    bm = best_move(board)
-                    print(bm)
-                    if bm is None:
-                        failed_to_decide = True
-                        continue
-                    board[bm[0]][bm[1]] = "O"
-                    bm1 = bm[0] * 3 + bm[1]
-                    ba = ByteArray([0xFF, 0x03, bm1, 0xFE])
-                    ser.write(ba)
-                    print(ba)
+                status = play_turn(cmd, frame, tracker, ctx, stamp_ns=stamp_ns)
+                if status == "retry":
+                    failed_to_decide = True
+                elif status == "moved":
                     failed_to_decide = False
-                    winner = decide_win(board)  # 再次检查是否结束
-                    if winner == 1:
-                        notify_winner("computer")
-                    elif winner == 3:
-                        notify_winner("draw")
-                    # board[bm[0]][bm[1]] = " "
-
-            cv.imshow("Frame", frame)
+                if status in ("ignored", "cheat", "retry"):
+                    continue
 
-            key = cv.waitKey(1) & 0xFF
-            if key == ord("q"):
+            with profiler.stage("preview"):
+                view.submit(frame, centers, pole, pieces)
+            if view.closed:
                 break
             t1 = datetime.datetime.now()
             if (t1 - t0).total_seconds() > 1:
                 print(f"FPS: {fc / (t1 - t0).total_seconds():.2f}")
+                if C.track_field:
+                    print("Field search:", field_tracker.stats)
+                print("Field contours:", field_filter.stats)
+                print("Piece contours:", piece_filter.stats)
+                if C.gate_frames:
+                    print("Frame gate:", gate.stats)
+                print("Serial:", transmission.transport.stats)
+                if C.delta_tx:
+                    print("Delta:", delta.stats)
+                print("Preview:", view.stats)
+                if profiler.enabled:
+                    print(profiler.report())
                 fc = 0
                 t0 = t1
             last_pole = pole
+        view.close()
         cap.release()
+        reader.close()
+        transmission.transport.close()
+        profiler.export(C.profile_json, C.profile_trace)
         return 0
     else:
         try:
+            last_seq = -1
             while True:
-                ret, frame = cap.read()
+                ret, frame, last_seq = next_frame(cap, last_seq)
                 if not ret:
+                    if getattr(cap, "exhausted", False):  # 回放结束
+                        return 0
                     print("Fatal: No frame got")
+                    if hasattr(cap, "read_next"):
+                        continue
                     return ErrCode.NO_FRAME_GOT
                 find_field(frame)
         except KeyboardInterrupt:
@@ -0,0 +1,149 @@
+"""
+filename: motion.py
+author: Neolux Lee
+created: 2026-10-18
+last modified: 2026-10-18
+descrip: 低成本的画面变化检测，在缩略图上比较，避免整帧浮点运算
+version: 1.0
+copyright: © 2024 N.K.F.Lee
+"""
+
+import math
+
+import cv2 as cv
+import numpy as np
+
+
+class ChangeDetector:
+    """画面变化检测
+
+    当前帧先（按 ROI 截取后）缩成很小的灰度缩略图，再与参考缩略图比较：
+    "thumb" 为缩略图逐像素灰度差的最大值 (0~255)，缩略图每个像素是原图一块的均值，
+    噪声被平均掉，而一枚棋子仍能让对应的像素明显变化；
+    "hash" 为 64 位差值哈希的汉明距离 (0~64)，对整体亮度变化不敏感，适合纹理多的画面。
+    缩略图缓冲区预先分配，每帧只有几 KB 的运算量。
+
+    Args:
+        method (str, optional): "thumb" 或 "hash". Defaults to "thumb".
+        threshold (float, optional): 分数达到此值视为有变化. Defaults to 8.
+        size (tuple, optional): "thumb" 缩略图的 (宽, 高). Defaults to (32, 24).
+        roi (tuple, optional): 只看 (x0, y0, x1, y1) 范围. Defaults to None，整帧.
+    """
+
+    def __init__(self, method="thumb", threshold=8, size=(32, 24), roi=None):
+        if method not in ("thumb", "hash"):
+            raise ValueError(f"Unknown method: {method}")
+        self.method = method
+        self.threshold = threshold
+        self.size = size if method == "thumb" else (9, 8)
+        self._roi = roi
+        self._small = np.empty((self.size[1], self.size[0], 3), np.uint8)
+        self._thumbs = [np.empty(self.size[::-1], np.uint8) for _ in range(2)]
+        self._cur = 0  # 当前缩略图的下标，另一个是参考
+        self._ref_hash = None
+        self._cur_hash = None
+        self._has_ref = False
+        self.score = math.inf  # 最近一次计算的分数
+
+    @property
+    def roi(self):
+        return self._roi
+
+    @roi.setter
+    def roi(self, roi):
+        """更换 ROI 后参考失效，下一帧一定视为有变化"""
+        if roi != self._roi:
+            self._roi = roi
+            self._has_ref = False
+
+    def _thumbnail(self, frame):
+        if self._roi is not None:
+            x0, y0, x1, y1 = self._roi
+            frame = frame[y0:y1, x0:x1]
+        thumb = self._thumbs[self._cur]
+        if frame.ndim == 3:
+            cv.resize(frame, self.size, dst=self._small, interpolation=cv.INTER_AREA)
+            cv.cvtColor(self._small, cv.COLOR_BGR2GRAY, dst=thumb)
+        else:
+            cv.resize(frame, self.size, dst=thumb, interpolation=cv.INTER_AREA)
+        return thumb
+
+    def measure(self, frame):
+        """计算当前帧与参考的差异分数，不更新参考"""
+        thumb = self._thumbnail(frame)
+        if self.method == "hash":
+            bits = np.packbits(thumb[:, 1:] > thumb[:, :-1])
+            self._cur_hash = int.from_bytes(bits.tobytes(), "big")
+            if self._has_ref:
+                self.score = (self._cur_hash ^ self._ref_hash).bit_count()
+        elif self._has_ref:
+            ref = self._thumbs[1 - self._cur]
+            self.score = cv.norm(thumb, ref, cv.NORM_INF)
+        if not self._has_ref:
+            self.score = math.inf
+        return self.score
+
+    def accept(self):
+        """把最近一次 measure 的帧作为新的参考"""
+        self._cur = 1 - self._cur
+        self._ref_hash = self._cur_hash
+        self._has_ref = True
+
+    def changed(self, frame):
+        """有变化时返回 True，并以这一帧为新的参考"""
+        if self.measure(frame) >= self.threshold:
+            self.accept()
+            return True
+        return False
+
+
+class FrameGate:
+    """静止画面门控，放在取帧和检测之间
+
+    画面没有变化时直接复用上一次的检测结果，只有检测到运动、收到指令（invalidate）
+    或连续复用超过 max_age 帧时才重新检测。
+
+    Args:
+        detector (ChangeDetector, optional): 变化检测. Defaults to None，使用默认参数.
+        max_age (int, optional): 最多连续复用的帧数，防止缓慢漂移累积. Defaults to 120.
+    """
+
+    def __init__(self, detector=None, max_age=120):
+        self.detector = detector if detector is not None else ChangeDetector()
+        self.max_age = max_age
+        self.result = None
+        self.stats = {"frames": 0, "gated": 0, "computed": 0}
+        self._age = 0
+        self._force = True
+
+    def invalidate(self):
+        """下一帧必须重新检测，例如收到了串口指令"""
+        self._force = True
+
+    def process(self, frame, compute):
+        """按需检测
+
+        Args:
+            frame (cv.Mat): 图片一帧，在 compute 绘制之前比较
+            compute (function): compute(frame) 返回检测结果
+
+        Returns:
+            tuple: (检测结果, 是否为本帧新算的)
+        """
+        self.stats["frames"] += 1
+        score = self.detector.measure(frame)
+        if (
+            self._force
+            or self.result is None
+            or self._age >= self.max_age
+            or score >= self.detector.threshold
+        ):
+            self.detector.accept()
+            self.result = compute(frame)
+            self._age = 0
+            self._force = False
+            self.stats["computed"] += 1
+            return self.result, True
+        self._age += 1
+        self.stats["gated"] += 1
+        return self.result, False
@@ -4,15 +4,21 @@ import cv2 as cv
 import numpy as np
 import time, datetime
 
-from serial import Serial
-
 import config as C
 from config import ErrCode
-from ThreadingCam import ThreadCap
-from py_tic_tac_toe.game import best_move, decide_win, anti_cheat
-from transmission import ser, ByteArray
+from ThreadingCam import ThreadCap, next_frame
+from detection import DARK, LIGHT, BoardModel, classify_cells
+from py_tic_tac_toe.game import build_table
+from py_tic_tac_toe.tracker import GameTracker
+from transmission import ser, ByteArray, open_serial
+from protocol import CommandReader
+from profiler import profiler
+import preview
+
+reader = None
 
 
+@profiler.timed()
 def find_field(frame) -> np.array:
     frame = cv.GaussianBlur(frame, (5, 5), 0)
     mask = cv.inRange(frame, np.array([200, 200, 0]), np.array([255, 255, 200]))
@@ -26,27 +32,19 @@ def find_field(frame) -> np.array:
     (x, y), (w, h), angle = cv.minAreaRect(cnts[0])
     if w < 100 or h < 100:
         return None
-    centers = []
     # print(f"Angle: {angle}")
-    angle = angle / 180 * np.pi if angle < 45 else (angle - 90) / 180 * np.pi
-    mat = np.array([[np.cos(angle), -np.sin(angle)],
-                    [np.sin(angle), np.cos(angle)]])
-    ctr = np.array([x, y])
-    for j in range(3):
-        for i in range(3):
-            point = np.array([x - w / 2 + (1 + 2 * i) * w / 6, y - h / 2 + (1 + 2 * j) * h / 6])
-            point = np.dot(mat, point - ctr) + ctr
-            centers.append(point)
-    centers = np.array(centers, dtype=np.int32)
+    # 9 个格子中心由棋盘模型一次变换得到
+    centers = BoardModel.from_rect(((x, y), (w, h), angle)).centers()
     # a vertical line
     # cv.line(frame, (int(x - w / 2), int(y - h / 2)), (int(x - w / 2), int(y + h / 2)), (0, 255, 0), 2)
     # cv.imshow("Find Field", frame)
     return centers
 
 
-def read_board(frame, me) -> list | None:
-    field = find_field(frame)
-    board = [[" " for i in range(3)] for j in range(3)]
+@profiler.timed()
+def read_board(frame, me, field=None) -> list | None:
+    if field is None:
+        field = find_field(frame)
     if field is None:
         return None
     if me == 4:
@@ -59,16 +57,10 @@ def read_board(frame, me) -> list | None:
         return None
     gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
     # cv.imshow("gray", gray)
-    for idx, (cx, cy) in enumerate(field):
-        cv.putText(frame, str(idx), (cx, cy), cv.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 255), 2)
-        cv.circle(frame, (cx, cy), 5, (0, 0, 255), -1)
-        brightness = np.mean(gray[cy - 10:cy + 10, cx - 10:cx + 10])
-        if brightness < 150:
-            board[idx // 3][idx % 3] = ego
-        elif brightness > 240:
-            board[idx // 3][idx % 3] = tu
-    # cv.imshow("Read Board", frame)
-    return board
+    # 9 个 20x20 小块一次取出，去掉两端各 10% 后求均值
+    cells, _ = classify_cells(gray, field, half=10, stat="trimmed", light=240, dark=150)
+    piece = {DARK: ego, LIGHT: tu}
+    return [[piece.get(int(cell), " ") for cell in row] for row in cells]
 
 
 def show_board(board) -> None:
@@ -80,36 +72,17 @@ def show_board(board) -> None:
 
 
 def recv_cmd() -> int:
-    if ser is None:
+    """取一条后台线程已解析好的指令：4 / 5 开始任务，2 reset，1 unreset，0 没有指令"""
+    if reader is None:
         return -1
-    ret = 0
-    if ser.in_waiting:
-        bt = ser.read(1)
-        print(f"Received {bt}")
-        if bt == b'\xff':
-            if ser.in_waiting:
-                bt = ser.read(1)
-                print(f"Received {bt}")
-                if bt == b'\xb1':
-                    ret = 4
-                elif bt == b'\xc1':
-                    ret = 5
-                elif bt == b'\xa1':
-                    if ser.in_waiting:
-                        bt = ser.read(1)
-                        print(f"Received {bt}")
-                        if bt == b'\xa2':
-                            ret = 2  # reset
-                        else:
-                            ret = 1  # unreset
-                if ser.in_waiting:
-                    bt = ser.read(1)
-                    print(f"Received {bt}")
-                    if bt != b'\xfe':
-                        ret = 0
-    return ret
+    cmd = reader.poll()
+    if cmd is None:
+        return 0
+    print(f"Received {cmd}")
+    return cmd.code
 
 
+@profiler.timed()
 def send_cmd(move) -> None:
     if move is None:
         return
@@ -134,6 +107,7 @@ def report_cheat(old_pos, new_pos) -> None:
 
 
 def main() -> None:
+    build_table()  # 提前建好走法表，收到指令时只需查表
     if C.threading_cam:
         cap = ThreadCap(camera_index=C.cam_id, width=640, height=480, fps=120)
     else:
@@ -146,26 +120,32 @@ def main() -> None:
         print("Fatal: Camera not opened")
         return ErrCode.CAM_NO_OPENED
 
-    global ser
+    global ser, reader
     try:
-        ser = Serial(C.serial_port, C.serial_baud)
+        ser = open_serial(C.serial_port, C.serial_baud)
     except Exception as e:
         print(f"Fatal: Serial not opened: {e}")
         ser = None
         return ErrCode.SER_NOT_OPENED
+    reader = CommandReader(ser)
+    view = preview.from_config("frame")
 
     ret_code = 0
     err_times = 0
 
     ques = 0
     reset = False
-    last_board = None
+    tracker = GameTracker()
+    last_seq = -1
     while True:
         try:
-            ret, frame = cap.read()
+            with profiler.stage("capture"):
+                # ThreadCap 取只读视图不拷贝；画面静止时拿到的是上一帧，照常处理指令
+                ret, frame, last_seq = next_frame(cap, last_seq)
+            stamp_ns = time.perf_counter_ns()
             if not ret:
                 print("Fatal: No frame got")
-                if C.threading_cam:
+                if hasattr(cap, "read_next"):  # ThreadCap 还没有采到第一帧
                     continue
                 else:
                     ret_code = ErrCode.NO_FRAME_GOT
@@ -178,32 +158,37 @@ def main() -> None:
             else:
                 reset = False
             # print(f"Ques: {ques}, Reset: {reset}")
-            board = read_board(frame, ques) if reset else None
+            field = find_field(frame) if reset else None
+            board = read_board(frame, ques, field) if field is not None else None
             # board = read_board(frame, 4)
             show_board(board)
             if board:
-                if last_board:
-                    print("Last board:")
-                    show_board(last_board)
-                    cheat, old_pos, new_pos = anti_cheat(last_board, board)
-                    if cheat:
-                        print(f"Cheat: {old_pos + 1} -> {new_pos + 1}")
-                        report_cheat(new_pos, old_pos)
-                        continue
-                move = best_move(board)
+                print("Last board:")
+                show_board(tracker.board)
+                event = tracker.observe(board)
+                if event.kind == "move" and event.player == "O":
+                    print(f"Cheat: {event.old + 1} -> {event.new + 1}")
+                    report_cheat(event.new, event.old)
+                    continue
+                if event.kind not in ("none", "add"):
+                    tracker.sync(board)  # 与跟踪的局面对不上时以识别结果为准
+                with profiler.stage("best_move"):
+                    move = tracker.best_move()
                 print(move)
                 send_cmd(move)
-                board[move[0]][move[1]] = "O"
-                last_board = board
-            cv.imshow("frame", frame)
-            key = cv.waitKey(1) & 0xFF
-            if key == ord('q'):
+                profiler.span("capture->move", stamp_ns)
+                tracker.play(move, "O")
+            with profiler.stage("preview"):
+                # 只交给显示线程，绘制和 imshow 不在这里做
+                view.submit(frame, field, board=board)
+            key = view.take_key()
+            if view.closed:
                 break
             elif key == ord('r'):
                 ques = 0
                 reset = False
                 board = None
-                last_board = None
+                tracker.reset()
                 ret_code = 0
                 err_times = 0
         except Exception as e:
@@ -212,6 +197,8 @@ def main() -> None:
             if err_times > 10:
                 ret_code = -1
                 break
+    view.close()
+    profiler.export(C.profile_json, C.profile_trace)
     return ret_code
 
 
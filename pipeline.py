@@ -0,0 +1,246 @@
+"""
+filename: pipeline.py
+author: Neolux Lee
+created: 2026-10-18
+last modified: 2026-10-18
+descrip: 多级流水线，取帧、识别、对局逻辑、显示各自在独立线程上运行
+version: 1.0
+copyright: © 2024 N.K.F.Lee
+"""
+
+import heapq
+import queue
+import threading
+import time
+from collections import deque
+
+STOP = None  # 结束标记，沿流水线向下传递
+
+
+class Packet:
+    """流水线中传递的一帧
+
+    Args:
+        seq (int): 帧序号，取帧时按入队顺序连续编号
+        frame (cv.Mat): 图片，来自 ThreadCap 时是只读视图
+        cap_seq (int, optional): 帧在 ThreadCap 中的序号，用于检查视图是否已被覆盖. Defaults to None.
+    """
+
+    def __init__(self, seq, frame, cap_seq=None):
+        self.seq = seq
+        self.cap_seq = cap_seq
+        self.stamp_ns = time.perf_counter_ns()  # 取到这一帧的时刻
+        self.frame = frame
+        self.error = None
+
+    def __lt__(self, other):
+        return self.seq < other.seq
+
+
+class Stage:
+    """流水线的一级，从 inbox 取包，处理后放进 outbox
+
+    多个 worker 并行时结果可能乱序，下一级设置 ordered=True 按序号重新排好。
+
+    Args:
+        name (str): 名称
+        func (function): func(packet)，直接修改 packet
+        inbox (queue.Queue): 输入队列
+        outbox (queue.Queue): 输出队列
+        workers (int, optional): 线程数. Defaults to 1.
+        ordered (bool, optional): 是否按序号重排输入. Defaults to False.
+    """
+
+    def __init__(self, name, func, inbox, outbox, workers=1, ordered=False):
+        self.name = name
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.workers = workers
+        self.ordered = ordered
+        self.count = 0
+        self.latency_ns = deque(maxlen=200)  # 最近若干包的处理耗时
+        self._heap = []
+        self._next = 0
+        self._running = workers
+        self._lock = threading.Lock()  # 多 worker 时保护重排和计数
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{name}-{idx}", daemon=True)
+            for idx in range(workers)
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _get(self):
+        if not self.ordered:
+            return self.inbox.get()
+        with self._lock:
+            while not self._heap or self._heap[0][0] != self._next:
+                packet = self.inbox.get()
+                if packet is STOP:
+                    return STOP
+                heapq.heappush(self._heap, (packet.seq, packet))
+            seq, packet = heapq.heappop(self._heap)
+            self._next = seq + 1
+            return packet
+
+    def _run(self):
+        while True:
+            packet = self._get()
+            if packet is STOP:
+                self.inbox.put(STOP)  # 让同一级的其他 worker 也退出
+                with self._lock:
+                    self._running -= 1
+                    last = self._running == 0
+                if last:  # 所有 worker 的结果都已送出后再向下传递
+                    self.outbox.put(STOP)
+                return
+            if packet.error is None:
+                t0 = time.perf_counter_ns()
+                try:
+                    self.func(packet)
+                except Exception as e:
+                    print(f"Error in {self.name}: {e}")
+                    packet.error = e
+                elapsed = time.perf_counter_ns() - t0
+                with self._lock:
+                    self.count += 1
+                    self.latency_ns.append(elapsed)
+            self.outbox.put(packet)
+
+    def stats(self):
+        latency = list(self.latency_ns)
+        return {
+            "count": self.count,
+            "queue": self.inbox.qsize(),
+            "mean_ms": sum(latency) / len(latency) / 1e6 if latency else 0.0,
+            "max_ms": max(latency) / 1e6 if latency else 0.0,
+        }
+
+
+class Pipeline:
+    """取帧线程 + 若干处理级，最后一级的结果在调用 run 的线程上交给 sink
+
+    取帧时下一级队列满了就丢弃这一帧（不编号），保证延迟不会越积越多。
+
+    Args:
+        cap: 帧来源，ThreadCap 用 read_next 取只读视图，其他来源用 read；
+            回放来源还可以有 exhausted
+        stages (list): [(名称, 函数, worker 数)]
+        sink (function): sink(packet)，返回 False 时结束，例如显示窗口按了 q
+        depth (int, optional): 每个队列的容量. Defaults to 2.
+        timeout (float, optional): ThreadCap 没有新帧时，隔多久重新送一次最新一帧，秒. Defaults to 0.1.
+    """
+
+    def __init__(self, cap, stages, sink, depth=2, timeout=0.1):
+        self.cap = cap
+        self.timeout = timeout
+        self.sink = sink
+        self.dropped = 0  # 取帧时因队列满丢弃的帧数
+        self.latency_ns = deque(maxlen=200)  # 取帧到 sink 完成的端到端耗时
+        self._stop = threading.Event()
+        self._queues = [queue.Queue(depth) for _ in range(len(stages) + 1)]
+        self.stages = []
+        for idx, (name, func, workers) in enumerate(stages):
+            ordered = idx > 0 and stages[idx - 1][2] > 1
+            self.stages.append(
+                Stage(
+                    name,
+                    func,
+                    self._queues[idx],
+                    self._queues[idx + 1],
+                    workers,
+                    ordered,
+                )
+            )
+        # 最后一级是多 worker 时，sink 之前也要重排
+        self._reorder = len(stages) > 0 and stages[-1][2] > 1
+        self._capture = threading.Thread(target=self._read, name="capture", daemon=True)
+
+    def _frames(self):
+        """逐帧产出 (来源序号, 图片)，来源结束或 stop 后返回"""
+        if hasattr(self.cap, "read_next"):
+            # ThreadCap：阻塞等下一帧新画面，不拷贝。画面静止时不发布新帧，
+            # 每隔 timeout 送一次最新一帧，对局逻辑才能照常处理指令
+            last = -1
+            while not self._stop.is_set():
+                seq, _, frame = self.cap.read_next(last, timeout=self.timeout)
+                if seq >= 0:
+                    last = seq
+                elif getattr(self.cap, "stop_flag", False) or getattr(
+                    self.cap, "exhausted", False
+                ):
+                    return
+                else:
+                    seq, _, frame = self.cap.read_latest()
+                    if seq < 0:  # 还没有采到第一帧
+                        continue
+                yield seq, frame
+            return
+        while not self._stop.is_set():
+            ret, frame = self.cap.read()
+            if frame is None:
+                # 摄像头或回放读取失败时结束，暂时没有帧时稍等再读，不空转
+                if ret is False:
+                    return
+                self._stop.wait(0.001)
+                continue
+            yield None, frame
+
+    def _read(self):
+        seq = 0
+        for cap_seq, frame in self._frames():
+            try:
+                self._queues[0].put_nowait(Packet(seq, frame, cap_seq))
+                seq += 1
+            except queue.Full:
+                self.dropped += 1
+        self._queues[0].put(STOP)
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        """运行到取帧结束或 sink 返回 False"""
+        for stage in self.stages:
+            stage.start()
+        self._capture.start()
+        outbox = self._queues[-1]
+        heap = []
+        expected = 0
+        running = True
+        while running:
+            packet = outbox.get()
+            if packet is STOP:
+                break
+            heapq.heappush(heap, (packet.seq, packet))
+            # 不需要重排时每次都直接取出；需要时按序号取出所有已就绪的包
+            while running and heap and (not self._reorder or heap[0][0] == expected):
+                packet = heapq.heappop(heap)[1]
+                expected = packet.seq + 1
+                running = self.sink(packet) is not False
+                self.latency_ns.append(time.perf_counter_ns() - packet.stamp_ns)
+        self._stop.set()
+        # 排空剩下的包，让阻塞在满队列上的各级线程都能走到结束标记
+        while packet is not STOP:
+            try:
+                packet = outbox.get(timeout=1)
+            except queue.Empty:
+                break
+        self._capture.join(1)
+        for stage in self.stages:
+            stage.join(1)
+
+    def stats(self):
+        latency = list(self.latency_ns)
+        return {
+            "dropped": self.dropped,
+            "latency_ms": sum(latency) / len(latency) / 1e6 if latency else 0.0,
+            "stages": {stage.name: stage.stats() for stage in self.stages},
+        }
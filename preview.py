@@ -0,0 +1,292 @@
+"""
+filename: preview.py
+author: Neolux Lee
+created: 2026-10-18
+last modified: 2026-10-18
+descrip: 调试画面，识别结果的叠加绘制和显示放在单独的线程上，限制帧率并缩小画面，可以开窗口或输出 MJPEG
+version: 1.0
+copyright: © 2024 N.K.F.Lee
+"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2 as cv
+import numpy as np
+
+import config as C
+
+FIELD_COLOR = (0, 0, 255)
+INDEX_COLOR = (255, 255, 255)
+PIECE_COLOR = (128, 128, 255)
+POLE_COLOR = (0, 255, 0)
+BOARD_COLOR = (255, 0, 255)
+
+
+def draw_overlay(
+    image, centers=None, pole=None, pieces=None, board=None, scale=1.0, text=None
+):
+    """把识别结果画在图片上，坐标按 scale 缩放到图片大小
+
+    Args:
+        image (np.ndarray): 要画的图片，会被修改
+        centers (array-like, optional): 9 个格子中心，按格子序号排列. Defaults to None.
+        pole (list, optional): 棋盘左右极限. Defaults to None.
+        pieces (dict, optional): {"black": [...], "white": [...]}. Defaults to None.
+        board (list, optional): 3x3 棋盘状态，画在格子旁. Defaults to None.
+        scale (float, optional): 识别坐标到图片坐标的比例. Defaults to 1.0.
+        text (str, optional): 左上角的说明文字，如帧率. Defaults to None.
+
+    Returns:
+        np.ndarray: image
+    """
+    font = 0.4 + 0.6 * scale
+
+    def pt(x, y):
+        return int(x * scale), int(y * scale)
+
+    if pole is not None and not pole[0] == -1:
+        h = image.shape[0]
+        for x in pole:
+            cv.line(image, pt(x, 0), (pt(x, 0)[0], h), POLE_COLOR, 1)
+    if centers is not None and len(centers) == 9:
+        for idx, (cx, cy) in enumerate(centers):
+            cv.circle(image, pt(cx, cy), max(2, int(5 * scale)), FIELD_COLOR, -1)
+            cv.putText(
+                image, str(idx), pt(cx, cy), cv.FONT_HERSHEY_SIMPLEX, font, INDEX_COLOR
+            )
+            if board is not None:
+                label = board[idx // 3][idx % 3]
+                if label.strip():
+                    x, y = pt(cx, cy)
+                    cv.putText(
+                        image,
+                        label,
+                        (x, y + int(20 * scale)),
+                        cv.FONT_HERSHEY_SIMPLEX,
+                        font,
+                        BOARD_COLOR,
+                    )
+    if pieces:
+        for key in ("black", "white"):
+            for idx, (x, y) in enumerate(pieces.get(key, [])):
+                cv.circle(image, pt(x, y), max(2, int(5 * scale)), PIECE_COLOR, -1)
+                cv.putText(
+                    image,
+                    str(idx),
+                    pt(x, y),
+                    cv.FONT_HERSHEY_SIMPLEX,
+                    font,
+                    PIECE_COLOR,
+                )
+    if text:
+        cv.putText(image, text, (5, 15), cv.FONT_HERSHEY_SIMPLEX, 0.5, POLE_COLOR)
+    return image
+
+
+class Preview:
+    """调试画面
+
+    识别循环每帧调用 submit，只有距离上一次采纳超过 1 / fps 时才把画面缩小复制一份，
+    其余帧直接返回。绘制、imshow / waitKey、JPEG 编码都在后台线程上，
+    只显示最新的一帧，赶不上时丢帧，不会反过来拖慢取帧和识别。
+
+    Args:
+        mode (str, optional): "window" 开窗口；"mjpeg" 在 http://host:port/ 输出 MJPEG；
+            "off" 不显示，submit 直接返回. Defaults to "window".
+        fps (float, optional): 最高刷新率. Defaults to 15.
+        scale (float, optional): 画面缩小比例. Defaults to 0.5.
+        port (int, optional): MJPEG 端口. Defaults to 8080.
+        host (str, optional): MJPEG 监听地址. Defaults to "127.0.0.1".
+        quality (int, optional): JPEG 质量. Defaults to 70.
+        title (str, optional): 窗口标题. Defaults to "Frame".
+    """
+
+    def __init__(
+        self,
+        mode="window",
+        fps=15,
+        scale=0.5,
+        port=8080,
+        host="127.0.0.1",
+        quality=70,
+        title="Frame",
+    ):
+        if mode not in ("window", "mjpeg", "off"):
+            raise ValueError(f"Unknown preview mode: {mode}")
+        self.mode = mode
+        self.interval = 1 / fps if fps > 0 else 0
+        self.scale = scale
+        self.quality = quality
+        self.title = title
+        self.closed = False  # 窗口里按了 q，或已经 close
+        self._key = -1  # 窗口里最近一次按键，take_key 取走
+        self.stats = {"submitted": 0, "accepted": 0, "shown": 0}
+        self._cond = threading.Condition()
+        self._small = None  # 缩小后的画面，只在采纳时写入
+        self._result = None
+        self._fresh = False
+        self._next = 0.0
+        self._jpeg = None
+        self._jpeg_seq = 0
+        self._server = None
+        self._thread = None
+        if mode == "off":
+            return
+        if mode == "mjpeg":
+            self._server = _serve(self, host, port)
+            print(f"Preview: http://{host}:{self._server.server_port}/")
+        self._thread = threading.Thread(target=self._run, name="preview", daemon=True)
+        self._thread.start()
+
+    def submit(
+        self, frame, centers=None, pole=None, pieces=None, board=None, text=None
+    ):
+        """交一帧画面和识别结果，不到刷新时间时立即返回
+
+        Returns:
+            bool: 是否采纳了这一帧
+        """
+        if self._thread is None:
+            return False
+        self.stats["submitted"] += 1
+        now = time.monotonic()
+        if now < self._next:
+            return False
+        self._next = now + self.interval
+        h, w = frame.shape[:2]
+        size = (max(1, int(w * self.scale)), max(1, int(h * self.scale)))
+        with self._cond:
+            if self._small is None or self._small.shape[:2] != (size[1], size[0]):
+                self._small = np.empty(
+                    (size[1], size[0]) + frame.shape[2:], frame.dtype
+                )
+            # 缩小的同时完成复制，原图之后可以被下一帧覆盖
+            cv.resize(frame, size, dst=self._small, interpolation=cv.INTER_NEAREST)
+            self._result = (centers, pole, pieces, board, text)
+            self._fresh = True
+            self._cond.notify()
+        self.stats["accepted"] += 1
+        return True
+
+    def _run(self):
+        image = None
+        while not self.closed:
+            with self._cond:
+                fresh = self._cond.wait_for(lambda: self._fresh or self.closed, 0.05)
+                if fresh and not self.closed:
+                    if image is None or image.shape != self._small.shape:
+                        image = np.empty_like(self._small)
+                    np.copyto(image, self._small)
+                    centers, pole, pieces, board, text = self._result
+                    self._fresh = False
+            if self.closed:
+                break
+            if not fresh:
+                if self.mode == "window":
+                    self._poll_key()  # 没有新画面时也要处理窗口事件
+                continue
+            draw_overlay(image, centers, pole, pieces, board, self.scale, text)
+            if self.mode == "window":
+                cv.imshow(self.title, image)
+                self._poll_key()
+            else:
+                ok, buf = cv.imencode(
+                    ".jpg", image, [cv.IMWRITE_JPEG_QUALITY, self.quality]
+                )
+                if ok:
+                    with self._cond:
+                        self._jpeg = buf.tobytes()
+                        self._jpeg_seq += 1
+                        self._cond.notify_all()
+            self.stats["shown"] += 1
+        if self.mode == "window":
+            cv.destroyWindow(self.title)
+
+    def _poll_key(self):
+        key = cv.waitKey(1) & 0xFF
+        if key != 0xFF:
+            self._key = key
+            if key == ord("q"):
+                self.closed = True
+
+    def take_key(self):
+        """取走窗口里最近一次按键，没有时返回 -1"""
+        key, self._key = self._key, -1
+        return key
+
+    def wait_jpeg(self, seq, timeout=1.0):
+        """等待比 seq 新的 JPEG，返回 (seq, 数据)，超时或关闭时数据为 None"""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._jpeg_seq > seq or self.closed, timeout=timeout
+            )
+            if self._jpeg_seq > seq:
+                return self._jpeg_seq, self._jpeg
+            return seq, None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def _serve(preview, host, port):
+    """在后台线程上启动 MJPEG 服务，每个连接按 multipart/x-mixed-replace 推送最新的 JPEG"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/stream.mjpg"):
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header(
+                "Content-Type", "multipart/x-mixed-replace; boundary=frame"
+            )
+            self.end_headers()
+            seq = 0
+            try:
+                while not preview.closed:
+                    seq, data = preview.wait_jpeg(seq)
+                    if data is None:
+                        continue
+                    self.wfile.write(
+                        b"--frame\r\nContent-Type: image/jpeg\r\n"
+                        + f"Content-Length: {len(data)}\r\n\r\n".encode()
+                    )
+                    self.wfile.write(data)
+                    self.wfile.write(b"\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="preview-http", daemon=True
+    ).start()
+    return server
+
+
+def from_config(title="Frame"):
+    """按 config 创建，headless 时不开窗口（MJPEG 不受影响）"""
+    mode = C.preview
+    if C.headless and mode == "window":
+        mode = "off"
+    return Preview(
+        mode,
+        C.preview_fps,
+        C.preview_scale,
+        C.preview_port,
+        C.preview_host,
+        title=title,
+    )
@@ -0,0 +1,204 @@
+"""
+filename: profiler.py
+author: Neolux Lee
+created: 2026-10-18
+last modified: 2026-10-18
+descrip: 分阶段计时，滚动统计 p50 / p95 / p99，可导出 JSON 或 Chrome trace
+version: 1.0
+copyright: © 2024 N.K.F.Lee
+"""
+
+import functools
+import json
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+import config as C
+
+
+class _NullStage:
+    """关闭时 stage 返回的空上下文，不取时间也不分配对象"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullStage()
+
+
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+class Profiler:
+    """分阶段计时
+
+    用法：
+        with profiler.stage("find_field"): ...
+        @profiler.timed("best_move") 装饰函数
+        profiler.span("capture->write", t_capture) 记录从某个时刻到现在
+
+    时间统一用 time.perf_counter_ns()，取帧时记下的时刻可以一路带到串口写出。
+    每个名字保留最近 window 次耗时算分位数；trace 打开时还记录每一次的起止，
+    用于导出 Chrome trace（chrome://tracing 或 Perfetto 打开）。
+
+    Args:
+        enabled (bool, optional): 是否计时，关闭时 stage 直接返回空上下文. Defaults to False.
+        window (int, optional): 分位数统计的窗口. Defaults to 512.
+        trace (bool, optional): 是否记录每一次的起止. Defaults to False.
+        max_events (int, optional): trace 最多保留的事件数. Defaults to 100000.
+    """
+
+    def __init__(self, enabled=False, window=512, trace=False, max_events=100000):
+        self.enabled = enabled
+        self.window = window
+        self.trace = trace
+        self._samples = {}  # 名字 -> deque(耗时 ns)
+        self._counts = {}
+        self._events = deque(maxlen=max_events)  # (名字, 开始 ns, 结束 ns, 线程)
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter_ns()
+
+    def stage(self, name):
+        """计时上下文"""
+        if not self.enabled:
+            return _NULL
+        return _Stage(self, name)
+
+    def timed(self, name=None):
+        """计时装饰器，是否计时在调用时判断，可以随时开关"""
+
+        def decorator(func):
+            label = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter_ns()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(label, start, time.perf_counter_ns())
+
+            return wrapper
+
+        return decorator
+
+    def record(self, name, start_ns, end_ns):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+                self._counts[name] = 0
+            samples.append(end_ns - start_ns)
+            self._counts[name] += 1
+            if self.trace:
+                self._events.append(
+                    (name, start_ns, end_ns, threading.current_thread().name)
+                )
+
+    def span(self, name, start_ns):
+        """记录从 start_ns 到现在，例如取帧到串口写出"""
+        if self.enabled and start_ns is not None:
+            self.record(name, start_ns, time.perf_counter_ns())
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._events.clear()
+
+    def summary(self):
+        """{名字: {count, p50_ms, p95_ms, p99_ms, max_ms}}，按最近 window 次统计"""
+        with self._lock:
+            items = [(name, list(samples)) for name, samples in self._samples.items()]
+            counts = dict(self._counts)
+        result = {}
+        for name, samples in items:
+            if not samples:
+                continue
+            p50, p95, p99 = np.percentile(samples, (50, 95, 99)) / 1e6
+            result[name] = {
+                "count": counts[name],
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": max(samples) / 1e6,
+            }
+        return result
+
+    def report(self):
+        """每个阶段一行的文字汇总"""
+        lines = []
+        for name, s in self.summary().items():
+            lines.append(
+                f"{name:>20}: n={s['count']:<6} p50={s['p50_ms']:.2f}ms "
+                f"p95={s['p95_ms']:.2f}ms p99={s['p99_ms']:.2f}ms max={s['max_ms']:.2f}ms"
+            )
+        return "\n".join(lines)
+
+    def export(self, json_path="", trace_path=""):
+        """程序退出时按配置导出，路径为空的不导出"""
+        if not self.enabled:
+            return
+        if json_path:
+            self.save_json(json_path)
+        if trace_path:
+            self.save_trace(trace_path)
+
+    def save_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def save_trace(self, path):
+        """导出 Chrome trace 格式，需要 trace=True"""
+        with self._lock:
+            events = list(self._events)
+        threads = {}
+        trace = []
+        for name, start, end, thread in events:
+            tid = threads.setdefault(thread, len(threads))
+            trace.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start - self._origin) / 1e3,
+                    "dur": (end - start) / 1e3,
+                    "pid": 0,
+                    "tid": tid,
+                }
+            )
+        for thread, tid in threads.items():
+            trace.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": 0,
+                    "tid": tid,
+                    "args": {"name": thread},
+                }
+            )
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+# 全局实例，main.py、neu.py、transmission.py 共用
+profiler = Profiler(enabled=C.profile, trace=bool(C.profile_trace))
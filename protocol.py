@@ -0,0 +1,323 @@
+"""
+filename: protocol.py
+author: Neolux Lee
+created: 2026-10-18
+last modified: 2026-10-18
+descrip: 串口帧编码，0xFF 开头 0xFE 结尾，坐标为大端 16 位
+version: 1.0
+copyright: © 2024 N.K.F.Lee
+"""
+
+import queue
+import struct
+import threading
+from collections import namedtuple
+
+HEAD = 0xFF
+TAIL = 0xFE
+
+# 发往下位机的帧类型
+PIECE = 0x01  # FF 01 颜色 序号 xh xl yh yl FE
+FIELD = 0x02  # FF 02 序号 xh xl yh yl FE
+MOVE = 0x03  # FF 03 落子位置 FE
+WINNER = 0x04  # FF 04 结果 FE
+CHEAT = 0x05  # FF 05 旧位置 新位置 FE
+
+BLACK = 0x01
+WHITE = 0x02
+
+WINNER_CODES = {"unsure": 0, "computer": 1, "human": 2, "draw": 3}
+
+FIELD_FRAME = struct.Struct(">BBBHHB")
+PIECE_FRAME = struct.Struct(">BBBBHHB")
+MOVE_FRAME = struct.Struct(">BBBB")
+WINNER_FRAME = struct.Struct(">BBBB")
+CHEAT_FRAME = struct.Struct(">BBBBB")
+
+
+class Encoder:
+    """把一帧画面要发的所有数据包打包进同一块预先分配的缓冲区
+
+    每次 encode_* 从缓冲区开头重新写，返回的 memoryview 在下一次 encode 之前有效，
+    需要保留时自行 bytes() 复制。
+
+    Args:
+        max_pieces (int, optional): 每种颜色最多的棋子数，决定缓冲区大小. Defaults to 10.
+    """
+
+    def __init__(self, max_pieces=10):
+        self.max_pieces = max_pieces
+        size = 9 * FIELD_FRAME.size + 2 * max_pieces * PIECE_FRAME.size
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+
+    def _field_into(self, offset, vertices):
+        pack = FIELD_FRAME.pack_into
+        for idx, (x, y) in enumerate(vertices):
+            pack(self._buf, offset, HEAD, FIELD, idx, x, y, TAIL)
+            offset += FIELD_FRAME.size
+        return offset
+
+    def _pieces_into(self, offset, pieces):
+        pack = PIECE_FRAME.pack_into
+        for color, key in ((BLACK, "black"), (WHITE, "white")):
+            for idx, (x, y) in enumerate(pieces[key][: self.max_pieces]):
+                pack(self._buf, offset, HEAD, PIECE, color, idx, x, y, TAIL)
+                offset += PIECE_FRAME.size
+        return offset
+
+    def encode_field(self, vertices):
+        """9 个格子中心，每个一帧"""
+        return self._view[: self._field_into(0, vertices)]
+
+    def encode_pieces(self, pieces):
+        """{"black": [...], "white": [...]} 中的棋子坐标，每个一帧"""
+        return self._view[: self._pieces_into(0, pieces)]
+
+    def encode_frame(self, vertices=None, pieces=None):
+        """一帧画面的格子和棋子合并成一段，一次写出"""
+        offset = 0
+        if vertices is not None:
+            offset = self._field_into(offset, vertices)
+        if pieces:
+            offset = self._pieces_into(offset, pieces)
+        return self._view[:offset]
+
+    def encode_packets(self, field, pieces):
+        """只打包给出的数据包
+
+        Args:
+            field (list): [(序号, x, y)]
+            pieces (list): [(颜色, 序号, x, y)]
+        """
+        offset = 0
+        for idx, x, y in field:
+            FIELD_FRAME.pack_into(self._buf, offset, HEAD, FIELD, idx, x, y, TAIL)
+            offset += FIELD_FRAME.size
+        for color, idx, x, y in pieces:
+            PIECE_FRAME.pack_into(
+                self._buf, offset, HEAD, PIECE, color, idx, x, y, TAIL
+            )
+            offset += PIECE_FRAME.size
+        return self._view[:offset]
+
+
+def encode_move(idx):
+    return MOVE_FRAME.pack(HEAD, MOVE, idx, TAIL)
+
+
+def encode_winner(winner):
+    return WINNER_FRAME.pack(HEAD, WINNER, WINNER_CODES.get(winner, 0), TAIL)
+
+
+def encode_cheat(old_pos, new_pos):
+    return CHEAT_FRAME.pack(HEAD, CHEAT, old_pos, new_pos, TAIL)
+
+
+# 下位机一侧解析上位机发来的数据包
+# kind: "piece" (颜色, 序号, x, y)；"field" (序号, x, y)；"move" (位置,)；
+#       "winner" (结果,)；"cheat" (旧位置, 新位置)
+Packet = namedtuple("Packet", ["kind", "args"])
+
+_PACKETS = {
+    PIECE: ("piece", PIECE_FRAME),
+    FIELD: ("field", FIELD_FRAME),
+    MOVE: ("move", MOVE_FRAME),
+    WINNER: ("winner", WINNER_FRAME),
+    CHEAT: ("cheat", CHEAT_FRAME),
+}
+
+
+class PacketParser:
+    """流式解析上位机发出的数据包，供假下位机和测试使用
+
+    坐标字节里可能出现 0xFF / 0xFE，所以按帧类型的固定长度切帧，帧尾不对时
+    从帧头的下一个字节重新找帧头。
+    """
+
+    def __init__(self):
+        self.stats = {"packets": 0, "skipped": 0}
+        self._buf = bytearray()
+
+    def feed(self, data):
+        """输入新收到的字节
+
+        Returns:
+            list: 本次解析出的完整数据包，按到达顺序
+        """
+        buf = self._buf
+        buf += data
+        packets = []
+        pos = 0
+        while True:
+            start = buf.find(HEAD, pos)
+            if start < 0:
+                self.stats["skipped"] += len(buf) - pos
+                pos = len(buf)
+                break
+            self.stats["skipped"] += start - pos
+            if start + 1 >= len(buf):
+                pos = start
+                break
+            kind = _PACKETS.get(buf[start + 1])
+            if kind is None:
+                self.stats["skipped"] += 1
+                pos = start + 1
+                continue
+            name, frame = kind
+            if start + frame.size > len(buf):
+                pos = start
+                break
+            fields = frame.unpack_from(buf, start)
+            if fields[-1] != TAIL:
+                self.stats["skipped"] += 1
+                pos = start + 1
+                continue
+            packets.append(Packet(name, fields[2:-1]))
+            pos = start + frame.size
+        del buf[:pos]
+        self.stats["packets"] += len(packets)
+        return packets
+
+
+# 下位机发来的指令
+# kind: "task" 开始任务 code 4 / 5；"reset" code 2；"unreset" code 1
+Command = namedtuple("Command", ["kind", "code"])
+
+TASK_4 = Command("task", 4)
+TASK_5 = Command("task", 5)
+RESET = Command("reset", 2)
+UNRESET = Command("unreset", 1)
+
+# 帧内容（不含帧头帧尾）到指令
+_COMMANDS = {b"\xb1": TASK_4, b"\xc1": TASK_5, b"\xa1\xa2": RESET}
+# 不带帧头帧尾的单字节 ASCII 指令，main.py 的下位机这样发
+_LEGACY = {ord("4"): TASK_4, ord("5"): TASK_5}
+
+
+def encode_command(cmd):
+    """指令编码为帧，假下位机发送时使用"""
+    if cmd == UNRESET:
+        return bytes([HEAD, 0xA1, 0x00, TAIL])
+    for payload, known in _COMMANDS.items():
+        if known == cmd:
+            return bytes([HEAD]) + payload + bytes([TAIL])
+    raise ValueError(f"Unknown command: {cmd}")
+
+
+class CommandParser:
+    """流式解析下位机指令，数据可以任意切分，跨多次 feed 拼接
+
+    帧外遇到 0xFF 开始一帧，遇到 0xFE 结束；帧内再遇到 0xFF 说明前一帧残缺，
+    从这里重新开始；超过 max_len 仍没有帧尾的丢弃。帧外的 ASCII "4" / "5" 也认作指令，
+    其余帧外字节跳过。
+
+    Args:
+        max_len (int, optional): 帧内容的最大长度. Defaults to 4.
+    """
+
+    def __init__(self, max_len=4):
+        self.max_len = max_len
+        self.stats = {"commands": 0, "unknown": 0, "skipped": 0}
+        self._buf = bytearray()
+        self._in_frame = False
+
+    def reset(self):
+        self._buf.clear()
+        self._in_frame = False
+
+    def _decode(self, payload):
+        cmd = _COMMANDS.get(bytes(payload))
+        if cmd is None and len(payload) <= 2 and payload[:1] == b"\xa1":
+            cmd = UNRESET  # FF A1 xx FE，xx 不是 A2；xx 恰好是 FE 时只剩 FF A1 FE
+        return cmd
+
+    def feed(self, data):
+        """输入新收到的字节
+
+        Returns:
+            list: 本次解析出的完整指令，按到达顺序
+        """
+        commands = []
+        for byte in data:
+            if byte == HEAD:
+                if self._in_frame:
+                    self.stats["skipped"] += len(self._buf) + 1
+                self._buf.clear()
+                self._in_frame = True
+            elif not self._in_frame:
+                cmd = _LEGACY.get(byte)
+                if cmd is None:
+                    self.stats["skipped"] += 1
+                else:
+                    commands.append(cmd)
+            elif byte == TAIL:
+                cmd = self._decode(self._buf)
+                if cmd is None:
+                    self.stats["unknown"] += 1
+                else:
+                    commands.append(cmd)
+                self._buf.clear()
+                self._in_frame = False
+            elif len(self._buf) >= self.max_len:
+                self.stats["skipped"] += len(self._buf) + 2
+                self._buf.clear()
+                self._in_frame = False
+            else:
+                self._buf.append(byte)
+        self.stats["commands"] += len(commands)
+        return commands
+
+
+class CommandReader:
+    """后台线程持续读串口并解析，指令到达后立即可取，与帧率无关
+
+    Args:
+        serial: 串口，需要有 in_waiting / read
+        parser (CommandParser, optional): 解析器. Defaults to None，新建一个.
+        idle (float, optional): 串口 read 不阻塞时，没有数据的轮询间隔，秒. Defaults to 0.001.
+    """
+
+    def __init__(self, serial, parser=None, idle=0.001):
+        self.serial = serial
+        self.parser = parser if parser is not None else CommandParser()
+        self.idle = idle
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="serial-rx", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                # 有积压时一次读完；没有时 read(1) 在真实串口上阻塞到下一个字节
+                data = self.serial.read(max(1, self.serial.in_waiting))
+            except Exception as e:
+                print(f"Error: Serial read failed: {e}")
+                self._stop.wait(0.1)
+                continue
+            if not data:
+                self._stop.wait(self.idle)
+                continue
+            for cmd in self.parser.feed(data):
+                self._queue.put(cmd)
+
+    def pending(self):
+        return not self._queue.empty()
+
+    def poll(self):
+        """取出下一条指令，没有时返回 None"""
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def get(self, timeout=None):
+        """等待下一条指令，超时返回 None"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._stop.set()
@@ -3,13 +3,16 @@ filename: minimaxd.py
 author: Neolux Lee
 created: 2024-07-29
 last modified: 2024-07-29
-descrip: 
+descrip:
 version: 1.0
 copyright: © 2024 N.K.F.Lee
 """
 
 import math
 import random
+from collections import OrderedDict
+
+import numpy as np
 
 
 def print_board(board):
@@ -18,108 +21,212 @@ def print_board(board):
         print("-" * 5)
 
 
+# ---------------- 位棋盘 ----------------
+# 用两个 9 位整数分别记录 X 和 O 的位置，第 i * 3 + j 位对应 board[i][j]。
+# 胜负判断是对 8 条连线的掩码测试，落子枚举是逐位迭代，搜索过程中不再建临时列表。
+
+FULL_MASK = 0x1FF
+_LINES = [
+    (0, 1, 2),
+    (3, 4, 5),
+    (6, 7, 8),
+    (0, 3, 6),
+    (1, 4, 7),
+    (2, 5, 8),
+    (0, 4, 8),
+    (2, 4, 6),
+]
+WIN_MASKS = tuple(sum(1 << idx for idx in line) for line in _LINES)
+# 512 种落子掩码是否成线，预先算好，判胜只需一次下标
+_IS_WIN = [any(mask & w == w for w in WIN_MASKS) for mask in range(1 << 9)]
+
+
+def iter_bits(mask):
+    """按从低到高的顺序逐个取出掩码中置位的下标"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class BitBoard:
+    """位棋盘，x / o 分别是 X 和 O 的 9 位掩码"""
+
+    __slots__ = ("x", "o")
+
+    def __init__(self, x=0, o=0):
+        self.x = x
+        self.o = o
+
+    @classmethod
+    def from_list(cls, board):
+        """由 3x3 列表棋盘转换，除 "X" / "O" 外的格子都视为空"""
+        x = o = 0
+        for i in range(3):
+            row = board[i]
+            for j in range(3):
+                if row[j] == "X":
+                    x |= 1 << (i * 3 + j)
+                elif row[j] == "O":
+                    o |= 1 << (i * 3 + j)
+        return cls(x, o)
+
+    def to_list(self):
+        """转换回 3x3 列表棋盘"""
+        board = [[" " for _ in range(3)] for _ in range(3)]
+        for idx in iter_bits(self.x):
+            board[idx // 3][idx % 3] = "X"
+        for idx in iter_bits(self.o):
+            board[idx // 3][idx % 3] = "O"
+        return board
+
+    def mask(self, player):
+        return self.x if player == "X" else self.o
+
+    @property
+    def free(self):
+        return FULL_MASK & ~(self.x | self.o)
+
+    def wins(self, player):
+        return _IS_WIN[self.mask(player)]
+
+    def moves(self):
+        return iter_bits(self.free)
+
+    def count(self):
+        return (self.x | self.o).bit_count()
+
+    def __eq__(self, other):
+        return isinstance(other, BitBoard) and self.x == other.x and self.o == other.o
+
+    def __hash__(self):
+        return hash((self.x, self.o))
+
+    def __repr__(self):
+        return f"BitBoard(x=0b{self.x:09b}, o=0b{self.o:09b})"
+
+
+def as_bits(board):
+    """列表棋盘或位棋盘统一转成位棋盘"""
+    return board if isinstance(board, BitBoard) else BitBoard.from_list(board)
+
+
 def check_winner(board, player):
-    # 检查行
-    for row in board:
-        if all([cell == player for cell in row]):
-            return True
-    # 检查列
-    for col in range(3):
-        if all([board[row][col] == player for row in range(3)]):
-            return True
-    # 检查对角线
-    if all([board[i][i] == player for i in range(3)]):
-        return True
-    if all([board[i][2 - i] == player for i in range(3)]):
-        return True
-    return False
+    return as_bits(board).wins(player)
 
 
 def decide_win(board):
-    if check_winner(board, "X"):
-        return -1
-    elif check_winner(board, "O"):
-        return 1
-    elif not get_available_moves(board):
-        return 3
-    else:
-        return 0
+    return _solved()["winner"][board_key(board)]
 
 
 def get_available_moves(board):
-    moves = []
-    for i in range(3):
-        for j in range(3):
-            if board[i][j] == " ":
-                moves.append((i, j))
-    return moves
+    return [(idx // 3, idx % 3) for idx in as_bits(board).moves()]
+
+
+def minimax(board, depth, is_maximizing, tt=None, search=False):
+    """轮到 O (is_maximizing) 或 X 时的 minimax 值，默认查表
+
+    Args:
+        search (bool, optional): 实际搜索整棵博弈树，只用于和表对照. Defaults to False.
+    """
+    if not search:
+        return solved_value(board, is_maximizing)
+    bits = as_bits(board)
+    return _minimax(bits.x, bits.o, is_maximizing, tt)
 
 
-def minimax(board, depth, is_maximizing):
-    if check_winner(board, "X"):
+def _minimax(x, o, is_maximizing, tt=None):
+    if _IS_WIN[x]:
         return -1
-    elif check_winner(board, "O"):
+    elif _IS_WIN[o]:
         return 1
-    elif not get_available_moves(board):
+    free = FULL_MASK & ~(x | o)
+    if not free:
         return 0
+    if tt is not None:
+        key = tt.key(x, o, is_maximizing)
+        entry = tt.get(key)
+        if entry is not None and entry[1] == EXACT:
+            return entry[0]
 
     if is_maximizing:
         best_score = -math.inf
-        for move in get_available_moves(board):
-            board[move[0]][move[1]] = "O"
-            score = minimax(board, depth + 1, False)
-            board[move[0]][move[1]] = " "
+        for idx in iter_bits(free):
+            score = _minimax(x, o | 1 << idx, False, tt)
             best_score = max(score, best_score)
-        return best_score
     else:
         best_score = math.inf
-        for move in get_available_moves(board):
-            board[move[0]][move[1]] = "X"
-            score = minimax(board, depth + 1, True)
-            board[move[0]][move[1]] = " "
+        for idx in iter_bits(free):
+            score = _minimax(x | 1 << idx, o, True, tt)
             best_score = min(score, best_score)
-        return best_score
+    if tt is not None:
+        tt.put(key, best_score, EXACT)
+    return best_score
 
 
-def alpha_beta(board, depth, alpha, beta, is_maximizing):
-    if check_winner(board, "X"):
+def alpha_beta(board, depth, alpha, beta, is_maximizing, tt=None, search=False):
+    """同 minimax，默认查表；精确值在任何 (alpha, beta) 窗口下都是合法的返回值
+
+    Args:
+        search (bool, optional): 实际做 alpha-beta 搜索，只用于和表对照. Defaults to False.
+    """
+    if not search:
+        return solved_value(board, is_maximizing)
+    bits = as_bits(board)
+    return _alpha_beta(bits.x, bits.o, alpha, beta, is_maximizing, tt)
+
+
+def _alpha_beta(x, o, alpha, beta, is_maximizing, tt=None):
+    if _IS_WIN[x]:
         return -1
-    elif check_winner(board, "O"):
+    elif _IS_WIN[o]:
         return 1
-    elif not get_available_moves(board):
+    free = FULL_MASK & ~(x | o)
+    if not free:
         return 0
+    if tt is not None:
+        key = tt.key(x, o, is_maximizing)
+        entry = tt.get(key)
+        if entry is not None:
+            value, flag = entry
+            if flag == EXACT:
+                return value
+            elif flag == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if beta <= alpha:
+                return value
+        alpha0, beta0 = alpha, beta
 
     if is_maximizing:
         best_score = -math.inf
-        for move in get_available_moves(board):
-            board[move[0]][move[1]] = "O"
-            score = alpha_beta(board, depth + 1, alpha, beta, False)
-            board[move[0]][move[1]] = " "
+        for idx in iter_bits(free):
+            score = _alpha_beta(x, o | 1 << idx, alpha, beta, False, tt)
             best_score = max(score, best_score)
             alpha = max(alpha, score)
             if beta <= alpha:
                 break
-        return best_score
     else:
         best_score = math.inf
-        for move in get_available_moves(board):
-            board[move[0]][move[1]] = "X"
-            score = alpha_beta(board, depth + 1, alpha, beta, True)
-            board[move[0]][move[1]] = " "
+        for idx in iter_bits(free):
+            score = _alpha_beta(x | 1 << idx, o, alpha, beta, True, tt)
             best_score = min(score, best_score)
             beta = min(beta, score)
             if beta <= alpha:
                 break
-        return best_score
+    if tt is not None:
+        if best_score <= alpha0:
+            tt.put(key, best_score, UPPER)
+        elif best_score >= beta0:
+            tt.put(key, best_score, LOWER)
+        else:
+            tt.put(key, best_score, EXACT)
+    return best_score
 
 
 def count_pieces(board):
-    ci = 0
-    for i in range(3):
-        for j in range(3):
-            if board[i][j] != " ":
-                ci += 1
-    return ci
+    return as_bits(board).count()
 
 
 def random_drop():
@@ -128,59 +235,284 @@ def random_drop():
     return choice // 3, choice % 3
 
 
-def best_move(board, method="minimax"):
+# best_move 支持的方法
+METHODS = ("table", "minimax", "alpha-beta", "mnk")
+
+
+def best_move(board, method="table", tt=None, budget_ms=50, k=None, search=False):
+    """计算电脑 (O) 的最佳落子
+
+    Args:
+        board (list | BitBoard): 棋盘
+        method (str, optional): "table" / "minimax" / "alpha-beta" 查表，三者结果相同；
+            "mnk" 为任意尺寸棋盘的限时迭代加深搜索；其他值抛出 ValueError. Defaults to "table".
+        tt (TranspositionTable, optional): 搜索用的置换表，传入同一个表可以在整局中保持预热.
+            Defaults to None，此时每次调用新建一个.
+        budget_ms (float, optional): "mnk" 的时间预算，毫秒. Defaults to 50.
+        k (int, optional): "mnk" 连成几子获胜. Defaults to None，取 min(行数, 列数).
+        search (bool, optional): "minimax" / "alpha-beta" 实际搜索，只用于和表对照.
+            Defaults to False.
+
+    Returns:
+        tuple: (行, 列)，无处可下时为 None
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method: {method}")
+    if method == "mnk":
+        # 只在用到时导入，直接运行 game.py 时不需要 py_tic_tac_toe 包
+        from py_tic_tac_toe import mnk
+
+        if isinstance(board, BitBoard):
+            board = board.to_list()  # mnk 按列表的行列数确定棋盘大小
+        return mnk.search(board, k=k, budget_ms=budget_ms)[0]
+    if method == "table" or not search:
+        best = _solved()["best"][board_key(board)]
+        return None if best == -1 else (best // 3, best % 3)
+    bits = as_bits(board)
     best_score = -math.inf
     move = None
-    if board[1][1] == " ":
+    if bits.free & 1 << 4:
         return (1, 1)
+    if tt is None:
+        tt = TranspositionTable()
     # elif count_pieces(board) < 2:
     #     return random_drop()
-    for m in get_available_moves(board):
-        board[m[0]][m[1]] = "O"
+    for idx in bits.moves():
+        o = bits.o | 1 << idx
         score = (
-            minimax(board, 0, False)
+            _minimax(bits.x, o, False, tt)
             if method == "minimax"
-            else (
-                alpha_beta(board, 0, -math.inf, math.inf, False)
-                if method == "alpha-beta"
-                else 0
-            )
+            else _alpha_beta(bits.x, o, -math.inf, math.inf, False, tt)
         )
-        board[m[0]][m[1]] = " "
         if score > best_score:
             best_score = score
-            move = m
+            move = (idx // 3, idx % 3)
     return move
 
 
 def find_ego(board):
-    positions = []
-    for i in range(3):
-        for j in range(3):
-            if board[i][j] == "O":
-                positions.append((i, j))
-    return positions
+    return [(idx // 3, idx % 3) for idx in iter_bits(as_bits(board).o)]
 
 
 def anti_cheat(last_board, board):
-    last_pieces = count_pieces(last_board)
-    pieces = count_pieces(board)
-    if pieces - last_pieces == 1:
+    last_bits = as_bits(last_board)
+    bits = as_bits(board)
+    if bits.count() - last_bits.count() == 1:
         return False, 0, 0
-    last_posis = find_ego(last_board)
-    posis = find_ego(board)
-    if len(last_posis) == 0 or len(posis) == 0:
+    if not last_bits.o or not bits.o:
         return False, 0, 0
-    for posi in posis:
-        if posi not in last_posis:
-            new_pos = posi[0] * 3 + posi[1]
-    for posi in last_posis:
-        if posi not in posis:
-            old_pos = posi[0] * 3 + posi[1]
-    try:
-        return True, old_pos, new_pos
-    except:
+    # 出现了新位置且有旧位置消失，才算挪动了棋子；多个时取下标最大的
+    new = bits.o & ~last_bits.o
+    old = last_bits.o & ~bits.o
+    if not new or not old:
         return False, 0, 0
+    return True, old.bit_length() - 1, new.bit_length() - 1
+
+
+# ---------------- 置换表 ----------------
+# 不同落子顺序、以及旋转 / 翻转后相同的格局，搜索值都一样。
+# 把格局换算到 8 种对称形式中编码最小的那个作为键，缓存搜索结果。
+
+EXACT, LOWER, UPPER = 0, 1, 2
+# 8 种对称变换，_SYMMETRIES[s][idx] 为第 idx 格变换后的位置
+_SYMMETRIES = [
+    (0, 1, 2, 3, 4, 5, 6, 7, 8),  # 原样
+    (6, 3, 0, 7, 4, 1, 8, 5, 2),  # 旋转 90°
+    (8, 7, 6, 5, 4, 3, 2, 1, 0),  # 旋转 180°
+    (2, 5, 8, 1, 4, 7, 0, 3, 6),  # 旋转 270°
+    (2, 1, 0, 5, 4, 3, 8, 7, 6),  # 左右翻转
+    (6, 7, 8, 3, 4, 5, 0, 1, 2),  # 上下翻转
+    (0, 3, 6, 1, 4, 7, 2, 5, 8),  # 主对角线翻转
+    (8, 5, 2, 7, 4, 1, 6, 3, 0),  # 副对角线翻转
+]
+# 每种对称下 512 种掩码的换算表
+_SYM_MASKS = [
+    [sum(1 << perm[idx] for idx in iter_bits(mask)) for mask in range(1 << 9)]
+    for perm in _SYMMETRIES
+]
+
+
+def canonical(x, o):
+    """8 种对称形式中编码最小的一种，返回 (x, o)"""
+    return min((m[x], m[o]) for m in _SYM_MASKS)
+
+
+class TranspositionTable:
+    """带对称归一化的置换表，容量有限，按最近最少使用淘汰
+
+    Args:
+        maxsize (int, optional): 最多缓存的格局数. Defaults to 4096，
+            对称归一化后整棵 3x3 博弈树也用不完.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(x, o, is_maximizing):
+        cx, co = canonical(x, o)
+        return cx | co << 9 | is_maximizing << 18
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, value, flag):
+        self._entries[key] = (value, flag)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# ---------------- 预计算完美对弈表 ----------------
+# 3x3 棋盘一共只有 3^9 = 19683 种格局，一次性倒推出每个格局的
+# minimax 值和最佳落子，之后 best_move / decide_win 都是查表。
+
+# 掩码到三进制编码的换算表，board_key = _BASE3[x] + 2 * _BASE3[o]
+_BASE3 = [sum(3**idx for idx in iter_bits(mask)) for mask in range(1 << 9)]
+_table = None
+
+
+def board_key(board):
+    """棋盘编码为三进制整数，作为查表下标
+
+    Args:
+        board (list | BitBoard): 3x3 棋盘
+
+    Returns:
+        int: 编码，" " 为 0，"X" 为 1，"O" 为 2
+    """
+    bits = as_bits(board)
+    return _BASE3[bits.x] + 2 * _BASE3[bits.o]
+
+
+def build_table():
+    """枚举全部格局，倒推 minimax 值和最佳落子
+
+    与 minimax / best_move 的判定顺序保持一致：先判 X 胜，再判 O 胜，最后判满盘。
+    表只会建一次，main 在进入主循环前调用，避免第一次指令时等待。
+
+    Returns:
+        dict: winner (decide_win 结果)，max / min (轮到 O / X 时的 minimax 值)，
+            best (best_move 的落子下标，无处可下为 -1)
+    """
+    global _table
+    if _table is not None:
+        return _table
+    size = 3**9
+    winner = [0] * size
+    val_max = [0] * size
+    val_min = [0] * size
+    best = [-1] * size
+    positions = [(x, o) for x in range(1 << 9) for o in range(1 << 9) if not x & o]
+    # 子多的格局先算，子格局的值总是已经算好
+    positions.sort(key=lambda p: (p[0] | p[1]).bit_count(), reverse=True)
+    for x, o in positions:
+        key = _BASE3[x] + 2 * _BASE3[o]
+        free = FULL_MASK & ~(x | o)
+        if _IS_WIN[x]:
+            winner[key] = -1
+        elif _IS_WIN[o]:
+            winner[key] = 1
+        elif not free:
+            winner[key] = 3
+        if winner[key] != 0:
+            val_max[key] = val_min[key] = {-1: -1, 1: 1, 3: 0}[winner[key]]
+        else:
+            val_max[key] = max(val_min[key + 2 * 3**idx] for idx in iter_bits(free))
+            val_min[key] = min(val_max[key + 3**idx] for idx in iter_bits(free))
+        if free & 1 << 4:
+            best[key] = 4
+        elif free:
+            best_score = -math.inf
+            for idx in iter_bits(free):
+                if val_min[key + 2 * 3**idx] > best_score:
+                    best_score = val_min[key + 2 * 3**idx]
+                    best[key] = idx
+    _table = {"winner": winner, "max": val_max, "min": val_min, "best": best}
+    return _table
+
+
+def _solved():
+    return _table if _table is not None else build_table()
+
+
+def solved_value(board, is_maximizing):
+    """查表得到 minimax(board, 0, is_maximizing) 的值"""
+    return _solved()["max" if is_maximizing else "min"][board_key(board)]
+
+
+# ---------------- 批量求解 ----------------
+# 回放日志、压测防作弊逻辑时一次处理大量棋盘：
+# 数组棋盘 0 为空，-1 为 X，1 为 O，与 decide_win 的返回值一致。
+
+_POW3 = np.array([3**idx for idx in range(9)], dtype=np.int32)
+_table_arrays = None
+
+
+def _solved_arrays():
+    global _table_arrays
+    if _table_arrays is None:
+        table = _solved()
+        _table_arrays = {
+            name: np.array(table[name], dtype=np.int8)
+            for name in ("winner", "max", "best")
+        }
+    return _table_arrays
+
+
+def board_to_array(board):
+    """列表棋盘转为 (3, 3) int8 数组"""
+    code = {"X": -1, "O": 1}
+    return np.array(
+        [[code.get(cell, 0) for cell in row] for row in board], dtype=np.int8
+    )
+
+
+def array_to_board(arr):
+    """(3, 3) 数组转回列表棋盘"""
+    piece = {-1: "X", 1: "O"}
+    return [[piece.get(int(cell), " ") for cell in row] for row in arr]
+
+
+def solve_batch(boards):
+    """批量查表求解
+
+    Args:
+        boards (np.ndarray): (N, 3, 3) int8 数组
+
+    Returns:
+        tuple: moves (N,) 最佳落子下标 (行 * 3 + 列)，无处可下为 -1；
+            scores (N,) 轮到 O 时的 minimax 值；
+            winners (N,) decide_win 的结果
+    """
+    cells = np.asarray(boards, dtype=np.int8).reshape(-1, 9)
+    keys = ((cells == -1) + 2 * (cells == 1)).astype(np.int32) @ _POW3
+    arrays = _solved_arrays()
+    return arrays["best"][keys], arrays["max"][keys], arrays["winner"][keys]
 
 
 def main():
@@ -229,4 +561,4 @@ if __name__ == "__main__":
         print(old_pos, "->", new_pos)
     # board =  [['X', 'O', ' '], [' ', 'O', 'X'], [' ', ' ', ' ']]
     # bm = best_move(board)
-    # print(bm)
\ No newline at end of file
+    # print(bm)
@@ -0,0 +1,223 @@
+"""
+filename: mnk.py
+author: Neolux Lee
+created: 2026-10-18
+last modified: 2026-10-18
+descrip: m x n 棋盘、k 子连线的通用引擎，迭代加深 alpha-beta，带时间预算
+version: 1.0
+copyright: © 2024 N.K.F.Lee
+"""
+
+import math
+import time
+
+WIN_SCORE = 1_000_000
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class MNKGame:
+    """m x n 棋盘、k 子连线的规则
+
+    棋盘同样用位掩码表示，第 r * cols + c 位对应 board[r][c]。
+
+    Args:
+        rows (int): 行数
+        cols (int): 列数
+        k (int): 连成几子获胜
+    """
+
+    def __init__(self, rows, cols, k):
+        self.rows = rows
+        self.cols = cols
+        self.k = k
+        self.size = rows * cols
+        self.full = (1 << self.size) - 1
+        # 所有长度为 k 的连线：横、竖、主对角、副对角
+        self.lines = []
+        for r in range(rows):
+            for c in range(cols):
+                for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    er, ec = r + dr * (k - 1), c + dc * (k - 1)
+                    if 0 <= er < rows and 0 <= ec < cols:
+                        self.lines.append(
+                            sum(
+                                1 << ((r + dr * t) * cols + c + dc * t)
+                                for t in range(k)
+                            )
+                        )
+        self.lines_at = [
+            [line for line in self.lines if line >> idx & 1] for idx in range(self.size)
+        ]
+        # 经过的连线越多，格子越有价值，作为静态走法排序
+        self.cell_value = [len(lines) for lines in self.lines_at]
+        # 连线上已有 n 个己方棋子（对方为空）时的估值
+        self.weights = [0] + [4 ** (n - 1) for n in range(1, k + 1)]
+
+    def has_line(self, mask):
+        """mask 中是否已经有连成 k 子的线"""
+        for line in self.lines:
+            if mask & line == line:
+                return True
+        return False
+
+    def wins_with(self, mask, idx):
+        """刚落在 idx 的一子是否连成线"""
+        for line in self.lines_at[idx]:
+            if mask & line == line:
+                return True
+        return False
+
+    def evaluate(self, me, opp):
+        """启发式估值：统计只被一方占据的连线，从 me 的角度打分"""
+        score = 0
+        weights = self.weights
+        for line in self.lines:
+            a = me & line
+            b = opp & line
+            if a and not b:
+                score += weights[a.bit_count()]
+            elif b and not a:
+                score -= weights[b.bit_count()]
+        return score
+
+    def to_masks(self, board):
+        """列表棋盘转为 (x, o) 掩码"""
+        x = o = 0
+        for r in range(self.rows):
+            for c in range(self.cols):
+                if board[r][c] == "X":
+                    x |= 1 << (r * self.cols + c)
+                elif board[r][c] == "O":
+                    o |= 1 << (r * self.cols + c)
+        return x, o
+
+
+class Searcher:
+    """迭代加深的 negamax alpha-beta 搜索，超时立即放弃当前层
+
+    Args:
+        game (MNKGame): 规则
+        deadline_ns (int): 截止时刻，time.perf_counter_ns() 计
+    """
+
+    def __init__(self, game, deadline_ns):
+        self.game = game
+        self.deadline = deadline_ns
+        self.best_at = {}  # (me, opp) -> 上次搜索得到的最佳落子，用于走法排序
+        self.history = [0] * game.size
+        self.nodes = 0
+
+    def _ordered(self, me, opp, free):
+        game = self.game
+        history = self.history
+        moves = sorted(
+            iter_bits(free),
+            key=lambda idx: (history[idx], game.cell_value[idx]),
+            reverse=True,
+        )
+        first = self.best_at.get((me, opp), -1)
+        if first in moves:
+            moves.remove(first)
+            moves.insert(0, first)
+        return moves
+
+    def negamax(self, me, opp, depth, alpha, beta, ply):
+        self.nodes += 1
+        if time.perf_counter_ns() > self.deadline:
+            raise SearchTimeout
+        game = self.game
+        free = game.full & ~(me | opp)
+        if not free:
+            return 0
+        if depth == 0:
+            return game.evaluate(me, opp)
+        best_score = -math.inf
+        best_idx = -1
+        for idx in self._ordered(me, opp, free):
+            mine = me | 1 << idx
+            if game.wins_with(mine, idx):
+                score = WIN_SCORE - ply - 1  # 越早赢越好
+            else:
+                score = -self.negamax(opp, mine, depth - 1, -beta, -alpha, ply + 1)
+            if score > best_score:
+                best_score = score
+                best_idx = idx
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                self.history[idx] += depth * depth
+                break
+        self.best_at[(me, opp)] = best_idx
+        return best_score
+
+    def search(self, me, opp):
+        """迭代加深，返回最后一层完整搜索的结果
+
+        Returns:
+            tuple: (最佳落子下标, 分数, 完成的深度)，棋局已经结束时下标为 -1，
+                分数为 me 已胜 WIN_SCORE、已负 -WIN_SCORE、满盘 0
+        """
+        if self.game.has_line(me):
+            return -1, WIN_SCORE, 0
+        if self.game.has_line(opp):
+            return -1, -WIN_SCORE, 0
+        free = self.game.full & ~(me | opp)
+        if not free:
+            return -1, 0, 0
+        # 先给一个保底走法，哪怕第一层都没搜完也能按时返回
+        best_idx = self._ordered(me, opp, free)[0]
+        best_score = 0
+        done = 0
+        for depth in range(1, free.bit_count() + 1):
+            try:
+                score = self.negamax(me, opp, depth, -math.inf, math.inf, 0)
+            except SearchTimeout:
+                break
+            best_idx = self.best_at[(me, opp)]
+            best_score = score
+            done = depth
+            if abs(score) >= WIN_SCORE - self.game.size:
+                break  # 已经算出必胜 / 必败
+        return best_idx, best_score, done
+
+
+def iter_bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+_games = {}
+
+
+def get_game(rows, cols, k):
+    """同一规格的 MNKGame 只建一次"""
+    if (rows, cols, k) not in _games:
+        _games[(rows, cols, k)] = MNKGame(rows, cols, k)
+    return _games[(rows, cols, k)]
+
+
+def search(board, k=None, budget_ms=50, player="O"):
+    """在时间预算内为 player 找一步棋
+
+    Args:
+        board (list): rows x cols 的列表棋盘
+        k (int, optional): 连成几子获胜. Defaults to None，取 min(rows, cols).
+        budget_ms (float, optional): 时间预算，毫秒. Defaults to 50.
+        player (str, optional): 走棋方. Defaults to "O".
+
+    Returns:
+        tuple: ((行, 列) 或 None, player 角度的分数, 完成的搜索深度)，
+            已经有一方连成线或满盘时落子为 None、深度为 0
+    """
+    deadline_ns = time.perf_counter_ns() + int(budget_ms * 1e6)  # 建表等准备也计入预算
+    rows, cols = len(board), len(board[0])
+    game = get_game(rows, cols, k or min(rows, cols))
+    x, o = game.to_masks(board)
+    me, opp = (o, x) if player == "O" else (x, o)
+    idx, score, depth = Searcher(game, deadline_ns).search(me, opp)
+    move = None if idx == -1 else (idx // cols, idx % cols)
+    return move, score, depth
@@ -0,0 +1,115 @@
+"""
+filename: tracker.py
+author: Neolux Lee
+created: 2026-10-18
+last modified: 2026-10-18
+descrip: 对局跟踪，按观测到的增量更新局面，区分正常落子、作弊和识别噪声
+version: 1.0
+copyright: © 2024 N.K.F.Lee
+"""
+
+from collections import namedtuple
+
+from py_tic_tac_toe.game import (
+    METHODS,
+    BitBoard,
+    TranspositionTable,
+    as_bits,
+    best_move,
+)
+
+# kind:
+#   "none"   局面没有变化
+#   "add"    player 在 new 落了一子，正常走棋，已记入局面
+#   "move"   player 的棋子从 old 挪到了 new，视为作弊，不记入局面
+#   "remove" player 在 old 的棋子不见了，多半是手挡住了，不记入局面
+#   "noise"  其他无法解释的变化，不记入局面
+Event = namedtuple("Event", ["kind", "player", "old", "new"])
+
+_NONE = Event("none", None, -1, -1)
+_NOISE = Event("noise", None, -1, -1)
+
+
+class GameTracker:
+    """持有当前局面，每次识别结果只和当前局面做位运算比较，常数时间完成分类
+
+    Args:
+        method (str, optional): best_move 使用的方法. Defaults to "table".
+        search (bool, optional): "minimax" / "alpha-beta" 实际搜索而不是查表，
+            用于和表对照. Defaults to False.
+    """
+
+    def __init__(self, method="table", search=False):
+        if method not in METHODS:
+            raise ValueError(f"Unknown method: {method}")
+        self.method = method
+        self.search = search
+        self.tt = TranspositionTable()  # 整局保持预热
+        self.reset()
+
+    def reset(self):
+        self.bits = BitBoard()
+        self.history = []  # [(player, 下标)]
+        self.tt.clear()
+
+    def sync(self, board):
+        """直接以 board 为准，用于开局中途接入或识别结果与跟踪不符时"""
+        seen = as_bits(board)
+        self.bits = BitBoard(seen.x, seen.o)
+
+    @property
+    def board(self):
+        return self.bits.to_list()
+
+    def observe(self, board):
+        """与当前局面比较，分类这次观测
+
+        Args:
+            board (list | BitBoard): 识别到的棋盘
+
+        Returns:
+            Event: 分类结果，只有 "add" 会更新局面
+        """
+        seen = as_bits(board)
+        added_x = seen.x & ~self.bits.x
+        added_o = seen.o & ~self.bits.o
+        gone_x = self.bits.x & ~seen.x
+        gone_o = self.bits.o & ~seen.o
+        if not (added_x | added_o | gone_x | gone_o):
+            return _NONE
+        for player, added, gone, other in (
+            ("X", added_x, gone_x, added_o | gone_o),
+            ("O", added_o, gone_o, added_x | gone_x),
+        ):
+            if other:
+                continue
+            if _single(added) and not gone:
+                self.play(added.bit_length() - 1, player)
+                return Event("add", player, -1, added.bit_length() - 1)
+            if _single(added) and _single(gone):
+                return Event(
+                    "move", player, gone.bit_length() - 1, added.bit_length() - 1
+                )
+            if _single(gone) and not added:
+                return Event("remove", player, gone.bit_length() - 1, -1)
+        return _NOISE
+
+    def play(self, idx, player):
+        """记入一步棋，idx 为 行 * 3 + 列，也可以是 (行, 列)"""
+        if isinstance(idx, tuple):
+            idx = idx[0] * 3 + idx[1]
+        if player == "X":
+            self.bits = BitBoard(self.bits.x | 1 << idx, self.bits.o)
+        else:
+            self.bits = BitBoard(self.bits.x, self.bits.o | 1 << idx)
+        self.history.append((player, idx))
+
+    def best_move(self, method=None):
+        """当前局面下电脑的最佳落子，搜索时结果在整局中复用"""
+        return best_move(
+            self.bits, method or self.method, tt=self.tt, search=self.search
+        )
+
+
+def _single(mask):
+    return mask != 0 and mask & (mask - 1) == 0
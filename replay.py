@@ -0,0 +1,205 @@
+"""
+filename: replay.py
+author: Neolux Lee
+created: 2026-10-18
+last modified: 2026-10-18
+descrip: 离线回放，用录像或图片目录代替摄像头、用脚本指令代替串口，跑完整的 main 流程
+version: 1.0
+copyright: © 2024 N.K.F.Lee
+"""
+
+import argparse
+import glob
+import os
+import time
+from collections import deque
+
+import cv2 as cv
+
+import config as C
+from config import ErrCode
+from protocol import CommandParser
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+class FrameSource:
+    """录像文件或图片目录，接口与 cv.VideoCapture 相同
+
+    Args:
+        path (str): 录像文件或图片目录
+        loops (int, optional): 重复播放次数. Defaults to 1.
+    """
+
+    def __init__(self, path, loops=1):
+        self.path = path
+        self.loops = loops
+        self.index = 0  # 已读出的帧数
+        self.exhausted = False
+        if os.path.isdir(path):
+            self.images = sorted(
+                f
+                for f in glob.glob(os.path.join(path, "*"))
+                if f.lower().endswith(IMAGE_EXTS)
+            )
+            self.cap = None
+        else:
+            self.images = None
+            self.cap = cv.VideoCapture(path)
+        self._loop = 0
+        self._pos = 0
+
+    def isOpened(self):
+        if self.images is not None:
+            return len(self.images) > 0
+        return self.cap.isOpened()
+
+    def _read_once(self):
+        if self.images is None:
+            return self.cap.read()
+        if self._pos >= len(self.images):
+            return False, None
+        frame = cv.imread(self.images[self._pos])
+        self._pos += 1
+        return frame is not None, frame
+
+    def _rewind(self):
+        if self.images is None:
+            self.cap.set(cv.CAP_PROP_POS_FRAMES, 0)
+        self._pos = 0
+
+    def read(self):
+        ret, frame = self._read_once()
+        while not ret and self._loop + 1 < self.loops and self.index > 0:
+            self._loop += 1
+            self._rewind()
+            ret, frame = self._read_once()
+        if not ret:
+            self.exhausted = True
+            return False, None
+        self.index += 1
+        return True, frame
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+
+
+class ScriptedSerial:
+    """假串口，记录程序写出的全部数据；读不到数据，指令由 ScriptedReader 投递"""
+
+    def __init__(self):
+        self.sent = []  # 程序写出的数据
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def read(self, size=1):
+        return b""
+
+    def read_all(self):
+        return b""
+
+    def write(self, data):
+        self.sent.append(bytes(data))
+        return len(data)
+
+
+class ScriptedReader:
+    """按帧号同步投递指令，接口与 protocol.CommandReader 相同
+
+    没有后台线程：主循环读完第 N 帧后调用 pending / poll 时，帧号不超过 N 的指令都已到达，
+    同一份脚本每次回放都在同一帧处理指令。流水线模式下对局逻辑晚于取帧，仍然不确定。
+
+    Args:
+        commands (list): [(帧号, 指令字节)]，读到该帧时指令到达
+        source (FrameSource): 帧来源，用它的 index 作为时钟
+    """
+
+    def __init__(self, commands, source):
+        self.commands = sorted(commands)
+        self.source = source
+        self.parser = CommandParser()
+        self._queue = deque()
+        self._next = 0
+
+    def _deliver(self):
+        while (
+            self._next < len(self.commands)
+            and self.commands[self._next][0] <= self.source.index
+        ):
+            self._queue.extend(self.parser.feed(self.commands[self._next][1]))
+            self._next += 1
+
+    def pending(self):
+        self._deliver()
+        return len(self._queue) > 0
+
+    def poll(self):
+        """取出下一条指令，没有时返回 None"""
+        self._deliver()
+        return self._queue.popleft() if self._queue else None
+
+    def get(self, timeout=None):
+        return self.poll()
+
+    def close(self):
+        pass
+
+
+def parse_commands(items):
+    """解析 "帧号:指令"，指令为 4 / 5 或以 0x 开头的十六进制字节串"""
+    commands = []
+    for item in items:
+        frame, cmd = item.split(":", 1)
+        data = bytes.fromhex(cmd[2:]) if cmd.startswith("0x") else cmd.encode()
+        commands.append((int(frame), data))
+    return commands
+
+
+def run(path, commands, loops=1, headless=True):
+    """回放并统计吞吐
+
+    Returns:
+        dict: 返回值、帧数、耗时、帧率、写出的数据；一帧都没读到时返回值为 ErrCode.NO_FRAME_GOT
+    """
+    from main import main
+
+    C.headless = headless
+    source = FrameSource(path, loops)
+    serial = ScriptedSerial()
+    t0 = time.perf_counter()
+    ret = main(cap=source, serial=serial, reader=ScriptedReader(commands, source))
+    elapsed = time.perf_counter() - t0
+    if ret == 0 and source.index == 0:
+        # 文件能打开但解码不出画面（编码不支持、空录像等），不能当作回放成功
+        print(f"Fatal: No frame got from {path}")
+        ret = ErrCode.NO_FRAME_GOT
+    return {
+        "ret": ret,
+        "frames": source.index,
+        "seconds": elapsed,
+        "fps": source.index / elapsed if elapsed > 0 else 0.0,
+        "sent": serial.sent,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线回放 main 流程")
+    parser.add_argument("path", help="录像文件或图片目录")
+    parser.add_argument(
+        "-c", "--cmd", action="append", default=[], help="帧号:指令，如 10:4"
+    )
+    parser.add_argument("-n", "--loops", type=int, default=1, help="重复播放次数")
+    parser.add_argument("--show", action="store_true", help="开窗口显示")
+    args = parser.parse_args()
+
+    result = run(args.path, parse_commands(args.cmd), args.loops, not args.show)
+    print(
+        f"Frames: {result['frames']}, Time: {result['seconds']:.2f}s, "
+        f"FPS: {result['fps']:.2f}, Return: {result['ret']}"
+    )
+    for data in result["sent"]:
+        print("Sent:", " ".join(f"0x{byte:02X}" for byte in data))
+    exit(result["ret"])
@@ -0,0 +1,460 @@
+"""
+filename: selfcheck.py
+author: Neolux Lee
+created: 2026-10-18
+last modified: 2026-10-18
+descrip: 自检，不需要摄像头和串口，改动走法表、增量发送等之后运行，有失败时返回 1
+version: 1.0
+copyright: © 2024 N.K.F.Lee
+"""
+
+import argparse
+import time
+import traceback
+
+from protocol import BLACK
+
+# 名字 -> 函数，失败时抛出 AssertionError
+CHECKS = {}
+
+
+def check(name):
+    """注册一项自检"""
+
+    def decorator(func):
+        CHECKS[name] = func
+        return func
+
+    return decorator
+
+
+@check("delta_refresh_after_piece_removed")
+def _delta_refresh_after_piece_removed():
+    """预算紧张时有棋子被拿走，之后的定期刷新仍然要继续"""
+    from transmission import DeltaSender
+
+    delta = DeltaSender(refresh=1.0, budget=100)
+    field = [(100 + i, 100 + i) for i in range(9)]
+    four = {"black": [(500, 60 + i * 75) for i in range(4)], "white": []}
+    three = {"black": four["black"][:3], "white": []}
+    now = 0.0
+    delta.select(field, four, now)
+    for _ in range(100):  # 10 秒，每 0.1 秒一帧
+        now += 0.1
+        delta.select(field, three, now)
+    assert delta.stats["refresh"] >= 9, delta.stats
+    # 没有预算限制时最后一个棋子同样不能卡住刷新
+    delta = DeltaSender(refresh=1.0)
+    delta.select(field, four, 0.0)
+    delta._stale.add(("piece", BLACK, 3))
+    delta.select(field, three, 1.0)
+    assert delta.stats["refresh"] == 2, delta.stats
+
+
+@check("delta_output_not_dropped")
+def _delta_output_not_dropped():
+    """串口写得慢时，增量发送的数据也不能在后台队列里被丢弃，否则 sent / saved 统计不准"""
+    import transmission
+
+    class SlowSerial:
+        def __init__(self):
+            self.written = 0
+
+        def write(self, data):
+            time.sleep(0.02)
+            self.written += len(data)
+            return len(data)
+
+    serial = SlowSerial()
+    delta = transmission.DeltaSender()
+    transmission.bind(serial, delta_sender=delta)
+    try:
+        for i in range(30):
+            field = [(100 + i * 5, 100 + j * 40) for j in range(9)]
+            transmission.send_frame(field, {"black": [(500, 60)], "white": []})
+        transmission.transport.flush(5)
+        stats = dict(transmission.transport.stats)
+    finally:
+        transmission.bind(None)
+    assert stats["dropped"] == 0, stats
+    assert serial.written == delta.stats["sent"], (serial.written, delta.stats)
+
+
+@check("command_reader_exits_on_close")
+def _command_reader_exits_on_close():
+    """open_serial 打开的串口 read 有超时，CommandReader.close 之后线程能退出"""
+    from protocol import CommandReader
+    from transmission import open_serial
+
+    for port in ("fake", "loop://"):
+        reader = CommandReader(open_serial(port, 9600))
+        time.sleep(0.05)
+        reader.close()
+        reader._thread.join(1)
+        assert not reader._thread.is_alive(), port
+
+
+_LINES = [(0, 1, 2), (3, 4, 5), (6, 7, 8)]
+_LINES += [tuple(c + 3 * r for r in range(3)) for c in range(3)]
+_LINES += [(0, 4, 8), (2, 4, 6)]
+
+
+@check("fake_mcu_drain_at_line_rate")
+def _fake_mcu_drain_at_line_rate():
+    """假下位机的发送缓冲区不能让吞吐超过线路速率，drain 之后数据全部到达"""
+    from fake_mcu import FakeMCU
+
+    baud = 96000
+    mcu = FakeMCU(baud)
+    try:
+        t0 = time.monotonic()
+        mcu.host.write(bytes(2000))  # 在缓冲区以内，write 立即返回
+        mcu.to_mcu.drain()
+        elapsed = time.monotonic() - t0
+    finally:
+        mcu.close()
+    assert 2000 / elapsed <= baud / 10 * 1.01, 2000 / elapsed
+
+
+@check("bench_latency_drives_main")
+def _bench_latency_drives_main():
+    """bench_serial 的延迟由 main 经假下位机给出落子，main 在画面结束后正常退出"""
+    import bench_serial
+
+    result = bench_serial.bench_latency(115200, rounds=3)
+    assert result["rounds"] == 3, result
+
+
+@check("field_filter_keeps_rotated_rectangles")
+def _field_filter_keeps_rotated_rectangles():
+    """边长比 3 以内、任意旋转的矩形，能通过 is_square 的都不会被 field_filter 的第一级剔除"""
+    import functools
+
+    import cv2 as cv
+    import numpy as np
+
+    from detection import CandidateFilter, field_filter, is_square
+
+    loose = functools.partial(is_square, eps=0.05, tol=0.15)
+    for ratio in (1.0, 1.5, 2.0, 3.0):
+        for angle in range(0, 91, 5):
+            img = np.zeros((400, 400), np.uint8)
+            box = cv.boxPoints(((200, 200), (60 * ratio, 60), angle))
+            cv.fillPoly(img, [np.int32(np.round(box))], 255)
+            cnts, _ = cv.findContours(img, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+            for test in (is_square, loose):
+                if test(cnts[0])[0] == -1:
+                    continue
+                probe = CandidateFilter(
+                    field_filter.min_area,
+                    field_filter.min_extent,
+                    field_filter.max_aspect,
+                )
+                assert probe.select(cnts, test), (ratio, angle)
+
+
+@check("field_pyramid_falls_back")
+def _field_pyramid_falls_back():
+    """缩小 4 倍时找不齐格子的画面，find_field 退回原分辨率仍能找到棋盘"""
+    import detection
+    from synthetic import generate
+
+    samples = generate(20, 0)
+    missed = [
+        s
+        for s in samples
+        if len(detection.find_field_pyramid(s.frame, 4)[0]) != 9
+        and len(detection.find_field(s.frame, factor=1)[0]) == 9
+    ]
+    assert missed, "no frame where the coarse pass fails"
+    for sample in missed:
+        assert len(detection.find_field(sample.frame, factor=4)[0]) == 9
+
+
+def _scan_winner(cells):
+    """逐条线扫描列表棋盘，与 decide_win 的约定相同：X 胜 -1，O 胜 1，满盘 3，未分胜负 0"""
+    for player, value in (("X", -1), ("O", 1)):
+        if any(all(cells[i] == player for i in line) for line in _LINES):
+            return value
+    return 3 if " " not in cells else 0
+
+
+@check("table_exhaustive")
+def _table_exhaustive():
+    """全部 3^9 种格局上，走法表、批量求解与标量搜索的结果一致"""
+    import math
+
+    import numpy as np
+
+    from py_tic_tac_toe import game
+
+    game.build_table()
+    minimax_tt = game.TranspositionTable(maxsize=1 << 16)
+    alpha_beta_tt = game.TranspositionTable(maxsize=1 << 16)
+    boards = []
+    for code in range(3**9):
+        cells = [" XO"[code // 3**idx % 3] for idx in range(9)]
+        board = [cells[r * 3 : r * 3 + 3] for r in range(3)]
+        boards.append(board)
+        assert game.board_key(board) == code, (code, board)
+        winner = _scan_winner(cells)
+        assert game.decide_win(board) == winner, (board, winner)
+        for is_max in (True, False):
+            value = game.minimax(board, 0, is_max, minimax_tt, search=True)
+            assert game.solved_value(board, is_max) == value, (board, is_max)
+            assert game.minimax(board, 0, is_max) == value, (board, is_max)
+            pruned = game.alpha_beta(
+                board, 0, -math.inf, math.inf, is_max, alpha_beta_tt, search=True
+            )
+            assert pruned == value, (board, is_max, pruned, value)
+        move = game.best_move(board, "minimax", minimax_tt, search=True)
+        assert game.best_move(board) == move, (board, move)
+    moves, scores, winners = game.solve_batch(
+        np.stack([game.board_to_array(board) for board in boards])
+    )
+    for board, move, score, winner in zip(boards, moves, scores, winners):
+        expected = game.best_move(board)
+        assert move == (-1 if expected is None else expected[0] * 3 + expected[1])
+        assert score == game.solved_value(board, True), board
+        assert winner == game.decide_win(board), board
+
+
+@check("mnk_terminal_root")
+def _mnk_terminal_root():
+    """已经分出胜负或满盘的棋盘，mnk.search 不再给出落子"""
+    from py_tic_tac_toe import mnk
+
+    x_won = [["X", "X", "X"], ["O", "O", " "], [" ", " ", " "]]
+    o_won = [["O", "O", "O"], ["X", "X", " "], ["X", " ", " "]]
+    full = [["X", "O", "X"], ["X", "O", "O"], ["O", "X", "X"]]
+    assert mnk.search(x_won) == (None, -mnk.WIN_SCORE, 0)
+    assert mnk.search(o_won) == (None, mnk.WIN_SCORE, 0)
+    assert mnk.search(full) == (None, 0, 0)
+    assert mnk.search(x_won, player="X") == (None, mnk.WIN_SCORE, 0)
+
+
+@check("tracker_methods")
+def _tracker_methods():
+    """GameTracker 的每种方法都能给出合法且不输的落子"""
+    from py_tic_tac_toe.game import build_table
+    from py_tic_tac_toe.tracker import GameTracker
+
+    build_table()
+    for method, search in (
+        ("table", False),
+        ("minimax", False),
+        ("minimax", True),
+        ("alpha-beta", False),
+        ("alpha-beta", True),
+        ("mnk", False),
+    ):
+        tracker = GameTracker(method=method, search=search)
+        tracker.play(0, "X")
+        tracker.play(4, "O")
+        tracker.play(1, "X")
+        move = tracker.best_move()
+        assert move == (0, 2), (method, search, move)  # 必须堵住第一行
+
+
+@check("unknown_method_rejected")
+def _unknown_method_rejected():
+    """拼错的方法名报错，不能悄悄退回查表"""
+    from py_tic_tac_toe.game import best_move
+    from py_tic_tac_toe.tracker import GameTracker
+
+    board = [[" "] * 3 for _ in range(3)]
+    for call in (
+        lambda: best_move(board, "alphabeta"),
+        lambda: best_move(board, "alphabeta", search=True),
+        lambda: GameTracker(method="minmax"),
+    ):
+        try:
+            call()
+        except ValueError:
+            continue
+        raise AssertionError("unknown method accepted")
+
+
+@check("field_order_at_45")
+def _field_order_at_45():
+    """旋转 ±44°、±45° 时 0 号是图像中最靠下的角，第一行沿角度增大方向（向左）
+
+    期望的编号只由画面中各个角的位置决定：最下、最左、最右、最上的格子依次是 0、2、6、8 号。
+    """
+    import numpy as np
+
+    import detection
+    from synthetic import render
+
+    for angle in (-45, -44, 44, 45):
+        for scale in (0.85, 1.0, 1.1):
+            sample = render(angle, scale, brightness=1.05, gradient=0.1, noise=3)
+            truth = sample.centers
+            expected = {
+                0: truth[np.argmax(truth[:, 1])],
+                2: truth[np.argmin(truth[:, 0])],
+                4: truth.mean(axis=0),
+                6: truth[np.argmax(truth[:, 0])],
+                8: truth[np.argmin(truth[:, 1])],
+            }
+            for factor in (1, 2):
+                centers, _ = detection.find_field(sample.frame.copy(), factor=factor)
+                assert len(centers) == 9, (angle, scale, factor)
+                centers = np.float32(centers)
+                for idx, point in expected.items():
+                    error = np.linalg.norm(centers[idx] - point)
+                    assert error < 30 * scale, (angle, scale, factor, idx, error)
+
+
+class _FakeCamera:
+    """代替 cv.VideoCapture，每次 read 都写入不同的画面，still 时画面不变；on_read 在写入前调用"""
+
+    on_read = None
+    still = False
+
+    def __init__(self, *args):
+        self.count = 0
+
+    def set(self, *args):
+        return True
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
+
+    def read(self, image=None):
+        if self.on_read is not None:
+            self.on_read()
+        time.sleep(0.002)
+        self.count += 0 if self.still else 1
+        image[:] = self.count * 40 % 256
+        return True, image
+
+
+def _fake_camera(on_read=None, still=False):
+    """把 ThreadingCam 里的 cv.VideoCapture 换成 _FakeCamera，返回恢复函数"""
+    import ThreadingCam
+
+    original = ThreadingCam.cv.VideoCapture
+    _FakeCamera.on_read = staticmethod(on_read) if on_read else None
+    _FakeCamera.still = still
+    ThreadingCam.cv.VideoCapture = _FakeCamera
+
+    def restore():
+        ThreadingCam.cv.VideoCapture = original
+
+    return restore
+
+
+@check("threadcap_slot_invalid_while_writing")
+def _threadcap_slot_invalid_while_writing():
+    """采集线程覆盖槽位期间，原来那一帧的 valid() 必须已经是 False"""
+    from ThreadingCam import ThreadCap
+
+    holder = {}
+    stale = []
+
+    def on_read():
+        cap = holder.get("cap")
+        if cap is not None and cap.seq >= cap.slots - 1:
+            stale.append(cap.valid(cap.seq - cap.slots + 1))
+
+    restore = _fake_camera(on_read)
+    try:
+        cap = ThreadCap(width=64, height=48)
+        holder["cap"] = cap
+        time.sleep(0.2)
+        cap.release()
+    finally:
+        restore()
+    assert stale and not any(stale), (len(stale), sum(stale))
+
+
+@check("next_frame_on_still_camera")
+def _next_frame_on_still_camera():
+    """画面静止时 ThreadCap 不发布新帧，next_frame 仍然按周期返回最新一帧"""
+    from ThreadingCam import ThreadCap, next_frame
+
+    restore = _fake_camera(still=True)
+    try:
+        cap = ThreadCap(width=64, height=48)
+        last_seq = -1
+        t0 = time.perf_counter()
+        for _ in range(5):
+            ret, frame, last_seq = next_frame(cap, last_seq, timeout=0.05)
+            assert ret and frame is not None
+        elapsed = time.perf_counter() - t0
+        seq, similar = cap.seq, cap.similar
+        cap.release()
+    finally:
+        restore()
+    assert seq == 0 and last_seq == 0 and similar > 0, (seq, last_seq, similar)
+    assert elapsed < 1.0, elapsed
+
+
+@check("pipeline_heartbeat_on_still_camera")
+def _pipeline_heartbeat_on_still_camera():
+    """画面静止时流水线仍按周期把最新一帧送到最后，对局逻辑可以处理指令"""
+    from pipeline import Pipeline
+    from ThreadingCam import ThreadCap
+
+    packets = []
+
+    def sink(packet):
+        packets.append(packet.cap_seq)
+        return len(packets) < 5
+
+    restore = _fake_camera(still=True)
+    try:
+        cap = ThreadCap(width=64, height=48)
+        pipe = Pipeline(cap, [("noop", lambda packet: None, 1)], sink, timeout=0.05)
+        t0 = time.perf_counter()
+        pipe.run()
+        elapsed = time.perf_counter() - t0
+        cap.release()
+    finally:
+        restore()
+    assert packets == [0] * 5, packets
+    assert elapsed < 1.0, elapsed
+
+
+@check("replay_commands_by_frame")
+def _replay_commands_by_frame():
+    """回放脚本的指令在读到指定帧之后才出现，与线程调度无关"""
+    from types import SimpleNamespace
+
+    from replay import ScriptedReader, parse_commands
+
+    source = SimpleNamespace(index=0)
+    reader = ScriptedReader(parse_commands(["3:4", "3:0xFFA1A2FE", "5:5"]), source)
+    seen = []
+    for index in range(7):
+        source.index = index
+        while reader.pending():
+            seen.append((index, reader.poll().code))
+    assert seen == [(3, 4), (3, 2), (5, 5)], seen
+    assert reader.poll() is None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="自检")
+    parser.add_argument("--only", action="append", help="只跑指定的检查，可重复")
+    args = parser.parse_args(argv)
+    failed = 0
+    for name in args.only or list(CHECKS):
+        t0 = time.perf_counter()
+        try:
+            CHECKS[name]()
+        except Exception:
+            failed += 1
+            print(f"FAIL {name}")
+            traceback.print_exc()
+        else:
+            print(f"ok   {name} ({time.perf_counter() - t0:.2f}s)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    exit(main())
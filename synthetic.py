@@ -0,0 +1,188 @@
+"""
+filename: synthetic.py
+author: Neolux Lee
+created: 2026-10-18
+last modified: 2026-10-18
+descrip: 合成 640x480 的棋盘画面，带真值，用于识别的测速和准确率测试
+version: 1.0
+copyright: © 2024 N.K.F.Lee
+"""
+
+from collections import namedtuple
+
+import cv2 as cv
+import numpy as np
+
+WIDTH, HEIGHT = 640, 480
+
+# frame: BGR 图片
+# centers: (9, 2) 格子中心真值，按棋盘上的实际格子编号：正放时 0 号在右下，第一行从右往左，
+#   随棋盘一起旋转。|angle| < 45° 时与 detection.find_field 的顺序相同
+# board: 3x3 列表，" " 空，"W" 白棋，"B" 黑棋
+# white / black: 两侧棋子的中心，按 y 排序（white 在左侧，black 在右侧）
+# params: 生成参数
+Sample = namedtuple("Sample", ["frame", "centers", "board", "white", "black", "params"])
+
+# 颜色均为 BGR
+TABLE = (90, 90, 90)
+FRAME = (30, 30, 30)
+# 格子亮度要在光照变化（brightness x (1 ± gradient / 2)）的整个范围内保持在
+# detection.classify_cells 的阈值之间：170 * 1.1 * 1.075 = 201 < 210，170 * 0.95 * 0.925 = 149 > 100；
+# 白棋 250 * 0.95 * 0.925 = 220 > 210
+CELL = (170, 170, 170)
+WHITE_PIECE = (250, 250, 250)
+BLACK_PIECE = (10, 10, 10)
+# neu.find_field 用 inRange 找整块浅青色的棋盘
+NEU_BOARD = (230, 230, 150)
+NEU_LINE = (90, 90, 60)
+
+
+def _rotate(points, matrix):
+    pts = np.asarray(points, np.float32).reshape(1, -1, 2)
+    return cv.transform(pts, matrix)[0]
+
+
+def render(
+    angle=0.0,
+    scale=1.0,
+    center=(320, 240),
+    brightness=1.0,
+    gradient=0.0,
+    noise=0.0,
+    board=None,
+    white=3,
+    black=3,
+    style="main",
+    seed=0,
+):
+    """画一帧
+
+    Args:
+        angle (float, optional): 棋盘逆时针旋转角度，度. Defaults to 0.0.
+        scale (float, optional): 棋盘缩放，1 时格子 60 像素、间隔 10 像素. Defaults to 1.0.
+        center (tuple, optional): 棋盘中心. Defaults to (320, 240).
+        brightness (float, optional): 整体亮度倍数. Defaults to 1.0.
+        gradient (float, optional): 从左到右的亮度渐变幅度. Defaults to 0.0.
+        noise (float, optional): 高斯噪声标准差. Defaults to 0.0.
+        board (list, optional): 棋盘上的棋子，3x3，"W" / "B" / " ". Defaults to None，空棋盘.
+        white (int, optional): 左侧白棋个数. Defaults to 3.
+        black (int, optional): 右侧黑棋个数. Defaults to 3.
+        style (str, optional): "main" 深色底板上的浅色格子；"neu" 整块浅青色棋盘画网格线. Defaults to "main".
+        seed (int, optional): 噪声的随机种子. Defaults to 0.
+
+    Returns:
+        Sample: 画面和真值
+    """
+    board = board or [[" "] * 3 for _ in range(3)]
+    img = np.empty((HEIGHT, WIDTH, 3), np.uint8)
+    img[:] = TABLE
+    cx, cy = center
+    cell, gap = 60 * scale, 10 * scale
+    pitch = cell + gap
+    half = (3 * cell + 4 * gap) / 2
+    matrix = cv.getRotationMatrix2D((float(cx), float(cy)), angle, 1)
+    outline = _rotate(
+        [
+            (cx - half, cy - half),
+            (cx + half, cy - half),
+            (cx + half, cy + half),
+            (cx - half, cy + half),
+        ],
+        matrix,
+    )
+    centers = []
+    for idx in range(9):
+        r, c = divmod(idx, 3)
+        # 0 号格子在右下，第一行从右往左
+        centers.append((cx + (1 - c) * pitch, cy + (1 - r) * pitch))
+    centers = _rotate(centers, matrix)
+    if style == "main":
+        cv.fillPoly(img, [np.round(outline).astype(np.int32)], FRAME, cv.LINE_AA)
+        for x, y in centers:
+            square = [
+                (x - cell / 2, y - cell / 2),
+                (x + cell / 2, y - cell / 2),
+                (x + cell / 2, y + cell / 2),
+                (x - cell / 2, y + cell / 2),
+            ]
+            # 以格子中心为原点旋转
+            m = cv.getRotationMatrix2D((float(x), float(y)), angle, 1)
+            cv.fillPoly(
+                img, [np.round(_rotate(square, m)).astype(np.int32)], CELL, cv.LINE_AA
+            )
+    elif style == "neu":
+        cv.fillPoly(img, [np.round(outline).astype(np.int32)], NEU_BOARD, cv.LINE_AA)
+        for k in (-0.5, 0.5):
+            for a, b in (
+                ((cx - half, cy + k * pitch), (cx + half, cy + k * pitch)),
+                ((cx + k * pitch, cy - half), (cx + k * pitch, cy + half)),
+            ):
+                p, q = np.round(_rotate([a, b], matrix)).astype(np.int32)
+                cv.line(
+                    img, tuple(map(int, p)), tuple(map(int, q)), NEU_LINE, 2, cv.LINE_AA
+                )
+    else:
+        raise ValueError(f"Unknown style: {style}")
+    radius = int(round(20 * scale))
+    for idx, (x, y) in enumerate(centers):
+        piece = board[idx // 3][idx % 3]
+        if piece in ("W", "B"):
+            color = WHITE_PIECE if piece == "W" else BLACK_PIECE
+            cv.circle(
+                img, (int(round(x)), int(round(y))), radius, color, -1, cv.LINE_AA
+            )
+    wings = {"white": [], "black": []}
+    for name, count, x, color in (
+        ("white", white, 70, WHITE_PIECE),
+        ("black", black, WIDTH - 70, BLACK_PIECE),
+    ):
+        for i in range(count):
+            y = 60 + i * 75
+            cv.circle(img, (x, y), 22, color, -1, cv.LINE_AA)
+            wings[name].append((x, y))
+    if brightness != 1.0 or gradient:
+        ramp = brightness * (
+            1 + gradient * (np.arange(WIDTH, dtype=np.float32) / WIDTH - 0.5)
+        )
+        img = np.clip(img * ramp[None, :, None], 0, 255).astype(np.uint8)
+    if noise:
+        rng = np.random.default_rng(seed)
+        img = np.clip(img + rng.normal(0, noise, img.shape), 0, 255).astype(np.uint8)
+    params = {
+        "angle": angle,
+        "scale": scale,
+        "center": center,
+        "brightness": brightness,
+        "gradient": gradient,
+        "noise": noise,
+        "style": style,
+    }
+    return Sample(img, centers, board, wings["white"], wings["black"], params)
+
+
+def random_sample(rng, style="main", max_angle=45.0):
+    """随机参数画一帧，覆盖旋转、缩放、光照、噪声和棋子分布"""
+    angle = float(rng.uniform(-max_angle, max_angle))
+    scale = float(rng.uniform(0.85, 1.1))
+    center = (int(rng.integers(300, 341)), int(rng.integers(220, 261)))
+    cells = rng.choice([" ", "W", "B"], size=9, p=[0.5, 0.25, 0.25]).tolist()
+    board = [list(cells[r * 3 : r * 3 + 3]) for r in range(3)]
+    return render(
+        angle=angle,
+        scale=scale,
+        center=center,
+        brightness=float(rng.uniform(0.95, 1.1)),
+        gradient=float(rng.uniform(-0.15, 0.15)),
+        noise=float(rng.uniform(0, 6)),
+        board=board,
+        white=int(rng.integers(0, 6)),
+        black=int(rng.integers(0, 6)),
+        style=style,
+        seed=int(rng.integers(1 << 31)),
+    )
+
+
+def generate(n, seed=0, style="main", max_angle=45.0):
+    """生成 n 帧"""
+    rng = np.random.default_rng(seed)
+    return [random_sample(rng, style, max_angle) for _ in range(n)]
@@ -1,92 +1,329 @@
-from serial import Serial
+import asyncio
+import threading
+import time
+
+from serial import serial_for_url
+
+from profiler import profiler
+from protocol import (
+    BLACK,
+    FIELD_FRAME,
+    PIECE_FRAME,
+    WHITE,
+    Encoder,
+    encode_cheat,
+    encode_move,
+    encode_winner,
+)
 
 ser = None
+transport = None  # bind 之后所有发送都经过它，不在调用方线程上阻塞
+delta = None  # 设置后只发送有变化的坐标
+_encoder = Encoder()
 
 
 class ByteArray(bytearray):
-    def __init__(self, data):
-        super().__init__(data)
-        self.data = data
-
     def __str__(self):
-        return f"[{', '.join([f'0x{byte:02X}' for byte in self.data])}]"
+        return f"[{', '.join([f'0x{byte:02X}' for byte in self])}]"
 
 
-def send_field(vertices):
-    global ser
-    global blocks_center
-    if not ser:
+class SerialTransport:
+    """后台线程上的 asyncio 发送队列
+
+    send 只是把数据交给事件循环，立即返回；写协程每次把队列里积压的数据拼成一段，
+    一次 write 写出。位置更新可以丢：队列积压超过 maxsize 时直接丢弃并计数，
+    落子、胜负、作弊等指令从不丢弃。
+
+    Args:
+        serial: 串口，需要有 write
+        maxsize (int, optional): 可丢弃数据的最大积压数. Defaults to 4.
+    """
+
+    def __init__(self, serial, maxsize=4):
+        self.serial = serial
+        self.maxsize = maxsize
+        self.stats = {"queued": 0, "dropped": 0, "writes": 0, "bytes": 0}
+        self._loop = asyncio.new_event_loop()
+        self._queue = None
+        self._droppable = 0  # 队列中可丢弃数据的个数
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="serial-tx", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue()
+        self._ready.set()
+        self._loop.run_until_complete(self._writer())
+        self._loop.close()
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        stop = False
+        while not stop:
+            chunks = []
+            stamps = []
+            item = await self._queue.get()
+            taken = 1
+            while True:
+                if item is None:
+                    stop = True
+                    break
+                data, droppable, stamp = item
+                if stamp is not None:
+                    stamps.append(stamp)
+                self._droppable -= droppable
+                chunks.append(data)
+                if self._queue.empty():
+                    break
+                item = self._queue.get_nowait()
+                taken += 1
+            if chunks:
+                await self._write(loop, b"".join(chunks))
+                for label, stamp_ns in stamps:  # 取帧到数据真正写出
+                    profiler.span(label, stamp_ns)
+            for _ in range(taken):  # 写完才算完成，flush 才能等到数据真正写出
+                self._queue.task_done()
+
+    async def _write(self, loop, payload):
+        try:
+            with profiler.stage("serial_write"):
+                # pyserial 的 write 是阻塞的，放到线程池里，事件循环照常接收新数据
+                await loop.run_in_executor(None, self.serial.write, payload)
+        except Exception as e:
+            print(f"Error: Serial write failed: {e}")
+            return
+        self.stats["writes"] += 1
+        self.stats["bytes"] += len(payload)
+
+    def _enqueue(self, data, droppable, stamp):
+        if droppable and self._droppable >= self.maxsize:
+            self.stats["dropped"] += 1
+            return
+        self._droppable += droppable
+        self.stats["queued"] += 1
+        self._queue.put_nowait((data, droppable, stamp))
+
+    def send(self, data, droppable=False, stamp=None):
+        """非阻塞发送，data 会被复制
+
+        stamp 为 (名字, 取帧时刻 ns)，写出后以这个名字记录取帧到写出的耗时
+        """
+        self._loop.call_soon_threadsafe(self._enqueue, bytes(data), droppable, stamp)
+
+    def flush(self, timeout=None):
+        """等到已提交的数据全部写出"""
+        future = asyncio.run_coroutine_threadsafe(self._queue.join(), self._loop)
+        future.result(timeout)
+
+    def close(self, timeout=1):
+        """写完积压的数据后结束后台线程"""
+        if self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+            self._thread.join(timeout)
+
+
+class DeltaSender:
+    """增量发送：记住每个序号上次发出的坐标，只发移动超过 tolerance 像素的
+
+    每隔 refresh 秒全部重发一次，防止下位机漏收后一直不同步。发送量受每秒字节预算
+    限制，超出预算的数据包这一帧不发，之后有预算时补发，刷新也会分几帧发完。
+
+    Args:
+        tolerance (int, optional): 坐标变化超过这么多像素才发送. Defaults to 2.
+        refresh (float, optional): 全量刷新的间隔，秒. Defaults to 1.0.
+        budget (float, optional): 每秒字节预算. Defaults to None，不限制.
+        max_pieces (int, optional): 每种颜色最多发送的棋子数. Defaults to 10.
+    """
+
+    def __init__(self, tolerance=2, refresh=1.0, budget=None, max_pieces=10):
+        self.tolerance = tolerance
+        self.refresh = refresh
+        self.budget = budget
+        self.max_pieces = max_pieces
+        # full: 逐帧全量发送本应发出的字节数；sent: 实际发出；saved: 两者之差
+        self.stats = {"full": 0, "sent": 0, "saved": 0, "refresh": 0, "deferred": 0}
+        self._last = {}  # (帧类型, 颜色, 序号) -> (x, y)
+        self._last_refresh = -float("inf")
+        self._stale = set()  # 本轮刷新还没发出的 key
+        self._tokens = budget if budget is not None else 0
+        self._last_time = None
+
+    def reset(self):
+        """下一帧全量发送"""
+        self._last.clear()
+        self._last_refresh = -float("inf")
+
+    def _changed(self, key, x, y):
+        last = self._last.get(key)
+        return (
+            last is None
+            or abs(x - last[0]) > self.tolerance
+            or abs(y - last[1]) > self.tolerance
+        )
+
+    def _refill(self, now):
+        if self.budget is None:
+            return
+        if self._last_time is not None:
+            self._tokens = min(
+                self.budget, self._tokens + (now - self._last_time) * self.budget
+            )
+        self._last_time = now
+
+    def select(self, vertices, pieces, now=None):
+        """挑出这一帧要发送的数据包
+
+        Args:
+            vertices (list): 9 个格子中心，不足 9 个时不发
+            pieces (dict): {"black": [...], "white": [...]}
+            now (float, optional): 当前时刻，秒. Defaults to None，取 time.monotonic().
+
+        Returns:
+            tuple: ([(序号, x, y)], [(颜色, 序号, x, y)])，可直接交给 Encoder.encode_packets
+        """
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        candidates = []  # (key, 字节数, 数据包)
+        if vertices is not None and len(vertices) == 9:
+            for idx, (x, y) in enumerate(vertices):
+                candidates.append(
+                    (("field", 0, idx), FIELD_FRAME.size, (idx, int(x), int(y)))
+                )
+        if pieces:
+            for color, name in ((BLACK, "black"), (WHITE, "white")):
+                for idx, (x, y) in enumerate(pieces[name][: self.max_pieces]):
+                    candidates.append(
+                        (
+                            ("piece", color, idx),
+                            PIECE_FRAME.size,
+                            (color, idx, int(x), int(y)),
+                        )
+                    )
+        full = sum(size for _, size, _ in candidates)
+        # 这一帧已经没有的序号（棋子被拿走）不再等它发出，否则刷新会一直卡住
+        self._stale &= {key for key, _, _ in candidates}
+        # 上一轮刷新发完之后才开始新一轮，预算紧张时也能轮到每个序号
+        if candidates and not self._stale and now - self._last_refresh >= self.refresh:
+            self._last_refresh = now
+            self._stale = {key for key, _, _ in candidates}
+            self.stats["refresh"] += 1
+        field, sent_pieces = [], []
+        sent = 0
+        for key, size, packet in candidates:
+            if key not in self._stale and not self._changed(key, *packet[-2:]):
+                continue
+            if self.budget is not None and sent + size > self._tokens:
+                self.stats["deferred"] += 1
+                continue
+            (field if key[0] == "field" else sent_pieces).append(packet)
+            self._last[key] = packet[-2:]
+            self._stale.discard(key)
+            sent += size
+        if self.budget is not None:
+            self._tokens -= sent
+        self.stats["full"] += full
+        self.stats["sent"] += sent
+        self.stats["saved"] += full - sent
+        return field, sent_pieces
+
+
+def open_serial(port, baud, timeout=0.1):
+    """按地址打开串口
+
+    "fake" 为内存里的假下位机（fake_mcu.FakeMCU，可通过返回值的 mcu 操作），
+    其余交给 pyserial：设备路径，或者 "loop://" 等 URL。
+
+    Args:
+        port (str): 地址
+        baud (int): 波特率
+        timeout (float, optional): read 的超时，秒；CommandReader 的线程阻塞在 read(1) 上，
+            超时后才能检查是否该退出. Defaults to 0.1.
+    """
+    if port == "fake":
+        from fake_mcu import FakeMCU
+
+        host = FakeMCU(baud).host
+        host.timeout = timeout
+        return host
+    return serial_for_url(port, baud, timeout=timeout)
+
+
+def bind(serial, maxsize=4, delta_sender=None):
+    """设置本模块使用的串口，并为它启动后台发送队列
+
+    Args:
+        serial: 串口
+        maxsize (int, optional): 后台队列中可丢弃数据的最大积压数. Defaults to 4.
+        delta_sender (DeltaSender, optional): 增量发送. Defaults to None，每帧全量发送.
+    """
+    global ser, transport, delta
+    if transport is not None:
+        transport.close()
+    ser = serial
+    transport = SerialTransport(serial, maxsize) if serial is not None else None
+    delta = delta_sender
+    return transport
+
+
+def _send(data, droppable=False, stamp=None):
+    if transport is not None:
+        transport.send(data, droppable, stamp)
+    elif ser:
+        ser.write(data)
+        if stamp is not None:
+            profiler.span(*stamp)
+
+
+def send_frame(vertices, pieces, stamp_ns=None):
+    """一帧画面的格子和棋子坐标合并为一次写出，stamp_ns 为这一帧的取帧时刻"""
+    if not (ser or transport):
+        return
+    if vertices is not None and not len(vertices) == 9:
+        vertices = None
+    if delta is not None:
+        field, changed = delta.select(vertices, pieces)
+        if field or changed:
+            # select 已经把这些坐标记为发出，丢掉就要等到下一轮刷新才补上；
+            # 发送量由字节预算限制，不会在队列里越积越多，所以不可丢弃
+            _send(
+                _encoder.encode_packets(field, changed),
+                False,
+                ("capture->write", stamp_ns),
+            )
         return
-    if not len(vertices) == 9:
+    if vertices is None and not pieces:
         return
-    blocks_center = vertices
-    for idx, vertex in enumerate(vertices):
-        sent = [0xFF, 0x02, idx]
-        sent.append(vertex[0] >> 8)
-        sent.append(vertex[0] & 0xFF)
-        sent.append(vertex[1] >> 8)
-        sent.append(vertex[1] & 0xFF)
-        sent.append(0xFE)
-        sent = ByteArray(sent)
-        ser.write(sent)
-        # print(f"Field: {sent}")
-    print("Sent Field! ")
+    _send(_encoder.encode_frame(vertices, pieces), True, ("capture->write", stamp_ns))
+
+
+def send_field(vertices):
+    send_frame(vertices, None)
 
 
 def send_pieces(pieces):
-    global ser
-    if not ser:
-        return
-    if not pieces:
+    send_frame(None, pieces)
+
+
+def send_move(idx, stamp_ns=None):
+    if not (ser or transport):
         return
-    # if len(pieces["black"]) == 0 and len(pieces["white"]) == 0:
-    #     return
-    for idx, black in enumerate(pieces["black"]):
-        sent = [0xFF, 0x01, 0x01, idx]
-        sent.append(black[0] >> 8)
-        sent.append(black[0] & 0xFF)
-        sent.append(black[1] >> 8)
-        sent.append(black[1] & 0xFF)
-        sent.append(0xFE)
-        sent = ByteArray(sent)
-        ser.write(sent)
-        # print(f"White Piece: {sent}")
-    for idx, white in enumerate(pieces["white"]):
-        sent = [0xFF, 0x01, 0x02, idx]
-        sent.append(white[0] >> 8)
-        sent.append(white[0] & 0xFF)
-        sent.append(white[1] >> 8)
-        sent.append(white[1] & 0xFF)
-        sent.append(0xFE)
-        sent = ByteArray(sent)
-        ser.write(sent)
-        # print(f"Black Piece: {sent}")
-    print("Sent Pieces! ")
+    sent = encode_move(idx)
+    _send(sent, stamp=("capture->move", stamp_ns))
+    print("Move: ", ByteArray(sent))
 
 
 def notify_winner(winner):
-    global ser
-    if not ser:
+    if not (ser or transport):
         return
-    sent = [0xFF, 0x04, 0, 0xFE]
-    match winner:
-        case "unsure":
-            sent[2] = 0
-        case "computer":
-            sent[2] = 1
-        case "human":
-            sent[2] = 2
-        case "draw":
-            sent[2] = 3
-    sent = ByteArray(sent)
-    ser.write(sent)
+    _send(encode_winner(winner))
     print("Winner: ", winner)
 
 
 def notify_cheat(old_pos, new_pos):
-    global ser
-    if not ser:
+    if not (ser or transport):
         return
-    msg = ByteArray([0xFF, 0x05, old_pos, new_pos, 0xFE])  # 发送旧的序号和新的序号
-    ser.write(msg)
+    msg = ByteArray(encode_cheat(old_pos, new_pos))  # 发送旧的序号和新的序号
+    _send(msg)
     print("Cheat! ", msg)